@@ -0,0 +1,143 @@
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from hashlib import sha256
+from io import BytesIO
+from os.path import isfile
+
+from bedrock.hd import HDPrivateKey
+
+# master keys derived from mnemonics, so restores can skip PBKDF2 stretching
+CACHE_FILENAME = 'seed_cache.json'
+
+
+# scrypt cost, paid once per lookup. an attacker holding the cache file and
+# the mnemonic pays it for every BIP39 passphrase guess. it has to stay below
+# PBKDF2's 2048 rounds of HMAC-SHA512 or a cache hit would be slower than
+# the stretching it skips: ~1ms here against ~2ms for hashlib's PBKDF2
+SCRYPT_N = 2 ** 8
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+
+def normalize(mnemonic, password):
+    mnemonic = ' '.join(mnemonic.split()).encode()
+    return mnemonic + b'\x00' + password
+
+def derive_keys(mnemonic, password, salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P):
+    # (fingerprint, encryption key, mac key). the salt is per file, so
+    # guesses can't be precomputed or shared between caches
+    keys = hashlib.scrypt(normalize(mnemonic, password), salt=salt, n=n, r=r, p=p,
+                          maxmem=2 * 128 * r * n, dklen=96)
+    return keys[:32].hex(), keys[32:64], keys[64:]
+
+def keystream(key, nonce, length):
+    stream = b''
+    counter = 0
+    while len(stream) < length:
+        stream += hmac.new(key, nonce + counter.to_bytes(4, 'big'), sha256).digest()
+        counter += 1
+    return stream[:length]
+
+def encrypt(encryption_key, mac_key, plaintext):
+    nonce = os.urandom(16)
+    ciphertext = bytes(a ^ b for a, b in zip(plaintext, keystream(encryption_key, nonce, len(plaintext))))
+    tag = hmac.new(mac_key, nonce + ciphertext, sha256).digest()
+    return {'nonce': nonce.hex(), 'ciphertext': ciphertext.hex(), 'tag': tag.hex()}
+
+def decrypt(encryption_key, mac_key, entry):
+    # plaintext, or None if the entry has been tampered with
+    nonce = bytes.fromhex(entry['nonce'])
+    ciphertext = bytes.fromhex(entry['ciphertext'])
+    tag = hmac.new(mac_key, nonce + ciphertext, sha256).digest()
+    if not hmac.compare_digest(tag, bytes.fromhex(entry['tag'])):
+        return None
+    return bytes(a ^ b for a, b in zip(ciphertext, keystream(encryption_key, nonce, len(ciphertext))))
+
+
+class SeedCache:
+    # entries are indexed by a fingerprint that comes out of the same scrypt
+    # as their keys, so a lookup costs one scrypt however many wallets the
+    # cache holds
+
+    def __init__(self, filename=CACHE_FILENAME):
+        self.filename = filename
+        self.salt = os.urandom(16)
+        self.params = {'n': SCRYPT_N, 'r': SCRYPT_R, 'p': SCRYPT_P}
+        self.entries = {}
+        if isfile(filename):
+            with open(filename, 'r') as f:
+                data = json.load(f)
+            # caches written by earlier versions get rebuilt
+            if 'entries' in data:
+                self.salt = bytes.fromhex(data['salt'])
+                self.params = data['params']
+                self.entries = data['entries']
+
+    def save(self):
+        # master keys, even encrypted, are nobody else's business
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with open(fd, 'w') as f:
+            json.dump({'salt': self.salt.hex(), 'params': self.params, 'entries': self.entries}, f, indent=4)
+
+    def derive_keys(self, mnemonic, password):
+        return derive_keys(mnemonic, password, self.salt, **self.params)
+
+    def lookup(self, keys):
+        fingerprint, encryption_key, mac_key = keys
+        entry = self.entries.get(fingerprint)
+        if entry is None:
+            return None
+        serialized = decrypt(encryption_key, mac_key, entry)
+        if serialized is None:
+            return None
+        return HDPrivateKey.parse(BytesIO(serialized))
+
+    def store(self, keys, master_key):
+        fingerprint, encryption_key, mac_key = keys
+        self.entries[fingerprint] = encrypt(encryption_key, mac_key, master_key.serialize())
+        self.save()
+
+    def get(self, mnemonic, password=b''):
+        return self.lookup(self.derive_keys(mnemonic, password))
+
+    def put(self, mnemonic, master_key, password=b''):
+        self.store(self.derive_keys(mnemonic, password), master_key)
+
+    def generate(self, password=b'', testnet=True):
+        mnemonic, master_key = HDPrivateKey.generate(password=password, testnet=testnet)
+        self.put(mnemonic, master_key, password)
+        return mnemonic, master_key
+
+    def from_mnemonic(self, mnemonic, password=b'', testnet=True):
+        # a miss reuses the lookup's keys to store the result
+        keys = self.derive_keys(mnemonic, password)
+        master_key = self.lookup(keys)
+        if master_key is None:
+            master_key = HDPrivateKey.from_mnemonic(mnemonic, password=password, testnet=testnet)
+            self.store(keys, master_key)
+        return master_key
+
+
+if __name__ == '__main__':
+    count = 10
+    cache = SeedCache('seed_cache_benchmark.json')
+
+    start = time.time()
+    mnemonics = [cache.generate()[0] for _ in range(count)]
+    print(f'create: {(time.time() - start) / count * 1000:.1f}ms per wallet')
+
+    start = time.time()
+    for mnemonic in mnemonics:
+        HDPrivateKey.from_mnemonic(mnemonic, testnet=True)
+    print(f'restore (uncached): {(time.time() - start) / count * 1000:.1f}ms per wallet')
+
+    start = time.time()
+    for mnemonic in mnemonics:
+        cache.from_mnemonic(mnemonic)
+    print(f'restore (cached): {(time.time() - start) / count * 1000:.1f}ms per wallet')
+
+    os.remove(cache.filename)
@@ -0,0 +1,122 @@
+import time
+
+
+def outpoint(utxo):
+    return f"{utxo['prev_tx'].hex()}:{utxo['prev_index']}"
+
+
+class UtxoStore:
+
+    # seconds the backend may contradict a pending spend or local change
+    # before we believe it: the transaction never made it or got dropped
+    # from the mempool
+    expiry = 60 * 60
+
+    def __init__(self, utxos=None, pending=None, synced_at=None):
+        # what the backend last reported plus change from our own transactions
+        self.utxos = utxos or []
+        # outpoints we've spent that the backend may still report as unspent,
+        # with when we spent them
+        self.pending = dict(pending or {})
+        self.synced_at = synced_at
+
+    def serialize(self):
+        return {
+            'utxos': [dict(utxo, prev_tx=utxo['prev_tx'].hex()) for utxo in self.utxos],
+            'pending': self.pending,
+            'synced_at': self.synced_at,
+        }
+
+    @classmethod
+    def deserialize(cls, data):
+        now = time.time()
+        # entries saved before expiry existed start their clock now
+        utxos = [dict(utxo, prev_tx=bytes.fromhex(utxo['prev_tx'])) for utxo in data['utxos']]
+        for utxo in utxos:
+            if utxo.get('local'):
+                utxo.setdefault('created_at', now)
+        pending = data['pending']
+        if isinstance(pending, list):
+            pending = {outpoint: now for outpoint in pending}
+        return cls(utxos, pending, data['synced_at'])
+
+    def stale(self, max_age):
+        return self.synced_at is None or time.time() - self.synced_at > max_age
+
+    def sync(self, backend_utxos):
+        now = time.time()
+        backend_outpoints = {outpoint(utxo) for utxo in backend_utxos}
+        # the backend doesn't know our change's ancestors, or that it's ours.
+        # keep what we know until it confirms
+        ours = {outpoint(utxo): utxo for utxo in self.utxos if utxo.get('local')}
+        backend_utxos = [dict(ours[outpoint(utxo)], **utxo)
+                         if outpoint(utxo) in ours and not utxo.get('confirmations') else utxo
+                         for utxo in backend_utxos]
+        # keep our own unspent change until the backend knows about it too,
+        # or has gone without it for too long
+        local = [utxo for utxo in self.utxos
+                 if utxo.get('local') and outpoint(utxo) not in backend_outpoints
+                 and outpoint(utxo) not in self.pending
+                 and now - utxo['created_at'] < self.expiry]
+        # once the backend stops reporting a spent output it has caught up.
+        # if it keeps reporting it, the spend didn't happen after all
+        self.pending = {spent: marked_at for spent, marked_at in self.pending.items()
+                        if spent in backend_outpoints and now - marked_at < self.expiry}
+        self.utxos = list(backend_utxos) + local
+        self.synced_at = now
+
+    def unspent(self):
+        return [utxo for utxo in self.utxos if outpoint(utxo) not in self.pending]
+
+    def spendable(self, max_ancestors=0, max_ancestor_size=0):
+        # our unconfirmed change is only spendable if chaining another
+        # transaction onto it stays within the mempool's ancestor limits
+        spendable = []
+        for utxo in self.unspent():
+            if utxo.get('local'):
+                if utxo.get('ancestors', 1) >= max_ancestors:
+                    continue
+                if utxo.get('ancestor_size', 0) >= max_ancestor_size:
+                    continue
+            spendable.append(utxo)
+        return spendable
+
+    def mark_spent(self, utxos):
+        now = time.time()
+        for utxo in utxos:
+            self.pending[outpoint(utxo)] = now
+
+    def unmark_spent(self, utxos):
+        for utxo in utxos:
+            self.pending.pop(outpoint(utxo), None)
+
+    def ancestors(self, utxos, size=0):
+        # (count, size) of the unconfirmed transactions a transaction of "size"
+        # vbytes spending utxos depends on, including itself. shared
+        # ancestors get counted twice, which errs on the safe side
+        parents = {utxo['prev_tx']: utxo for utxo in utxos if utxo.get('local')}.values()
+        return (1 + sum(parent.get('ancestors', 1) for parent in parents),
+                size + sum(parent.get('ancestor_size', 0) for parent in parents))
+
+    def within_limits(self, utxos, size, max_ancestors, max_ancestor_size):
+        # coins that are each spendable can still add up past the limits
+        ancestors, ancestor_size = self.ancestors(utxos, size)
+        return ancestors <= max_ancestors and ancestor_size <= max_ancestor_size
+
+    def add(self, prev_tx, prev_index, amount, address, spent=(), size=0):
+        ancestors, ancestor_size = self.ancestors(spent, size)
+        utxo = {
+            'prev_tx': prev_tx,
+            'prev_index': prev_index,
+            'amount': amount,
+            'address': address,
+            'local': True,
+            'created_at': time.time(),
+            'ancestors': ancestors,
+            'ancestor_size': ancestor_size,
+        }
+        self.utxos.append(utxo)
+        return utxo
+
+    def remove(self, utxo):
+        self.utxos.remove(utxo)
@@ -1,38 +1,96 @@
+import fcntl
 import json
 
 from os.path import isfile
+from contextlib import contextmanager
 from io import BytesIO
 from random import randint
+from concurrent.futures import ThreadPoolExecutor
 
 from bedrock.tx import Tx, TxIn, TxOut
-from bedrock.script import address_to_script_pubkey
 from bedrock.helper import sha256
 from bedrock.hd import HDPrivateKey
 
-from services import get_balance, get_unspent, get_transactions, broadcast
+from services import get_balance, get_unspent, get_transactions, get_used_addresses, broadcast
+from address_cache import address, addresses
+from coin_selection import DUST, select_coins
+from fees import (MAX_STANDARD_SIZE, INPUT_SIZES, OUTPUT_SIZES, change_fee,
+                  estimate_size, fee_for, max_inputs, output_size, select_coins_by_fee_rate)
+from segwit import script_pubkey
+from signing import serialize_witness, sign_segwit_transaction, sign_transaction, vsize
+from utxo_store import UtxoStore
+from seed_cache import SeedCache
+
+# BIP44 legacy accounts, BIP84 native segwit ones
+PURPOSES = {'p2pkh': 44, 'p2wpkh': 84}
 
 class Wallet:
 
     filename = "wallet.json"
+    # seconds before unspent() asks the backend again
+    sync_interval = 60
+    # limits on chaining sends onto our own unconfirmed change, matching
+    # bitcoind's default -limitancestorcount and -limitancestorsize
+    max_ancestors = 25
+    max_ancestor_size = 101_000
 
-    def __init__(self, master_key, accounts):
+    def __init__(self, master_key, accounts, utxos=None):
         self.master_key = master_key
         self.accounts = accounts
+        # one UtxoStore per account
+        self.utxos = utxos or {}
 
     @classmethod
-    def create(cls, account_name):
+    def create(cls, account_name, address_type='p2pkh'):
         if isfile(cls.filename):
             raise OSError("wallet file already exists")
-        mnemonic, master_key = HDPrivateKey.generate(testnet=True)
+        mnemonic, master_key = SeedCache().generate(testnet=True)
         accounts = {}
         wallet = cls(master_key, accounts)
-        wallet.register_account(account_name)
+        wallet.register_account(account_name, address_type)
         return mnemonic, wallet
 
+    @classmethod
+    def restore(cls, mnemonic, account_names, gap_limit=20, address_type='p2pkh'):
+        if isfile(cls.filename):
+            raise OSError("wallet file already exists")
+        master_key = SeedCache().from_mnemonic(mnemonic, testnet=True)
+        accounts = {}
+        wallet = cls(master_key, accounts)
+        # nothing gets saved until the scan succeeds, so a failed restore can be retried
+        for account_name in account_names:
+            wallet.add_account(account_name, address_type)
+        # scan receiving & change chains of every account at the same time
+        chains = [(account_name, change) for account_name in account_names for change in (False, True)]
+        with ThreadPoolExecutor(max_workers=len(chains)) as executor:
+            indices = executor.map(lambda chain: wallet.scan(*chain, gap_limit), chains)
+            for (account_name, change), index in zip(chains, indices):
+                key = 'change_index' if change else 'receiving_index'
+                wallet.accounts[account_name][key] = index
+        wallet.save()
+        return wallet
+
+    def scan(self, account_name, change, gap_limit):
+        # look up windows of "gap_limit" addresses until a full window past
+        # the last used address comes back empty
+        next_index = 0
+        start = 0
+        while start < next_index + gap_limit:
+            window = range(start, start + gap_limit)
+            keys = [self.derive_key(account_name, change, address_index) for address_index in window]
+            window_addresses = addresses([key.pub.point for key in keys], address_type=self.address_type(account_name))
+            used = get_used_addresses(window_addresses)
+            for address_index, window_address in zip(window, window_addresses):
+                if window_address in used:
+                    next_index = address_index + 1
+            start += gap_limit
+        return next_index
+
     def serialize(self):
         dict = {
             'master_key': self.master_key.serialize().hex(),
             'accounts': self.accounts,
+            'utxos': {account_name: store.serialize() for account_name, store in self.utxos.items()},
         }
         return json.dumps(dict, indent=4)
 
@@ -46,6 +104,8 @@ class Wallet:
         data = json.loads(raw_json)
         master_key_stream = BytesIO(bytes.fromhex(data['master_key']))
         data['master_key'] = HDPrivateKey.parse(master_key_stream)
+        if 'utxos' in data:
+            data['utxos'] = {account_name: UtxoStore.deserialize(store) for account_name, store in data['utxos'].items()}
         return cls(**data)
 
     @classmethod
@@ -54,44 +114,66 @@ class Wallet:
             raw_json = f.read()
             return cls.deserialize(raw_json)
 
-    def register_account(self, account_name):
+    @classmethod
+    @contextmanager
+    def locked(cls):
+        # open the wallet and keep other processes from saving it until we're
+        # done. whoever saves last wins, so a process saving a copy it opened
+        # earlier would undo keys handed out and spends marked in between
+        with open(cls.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield cls.open()
+
+    def add_account(self, account_name, address_type='p2pkh'):
         assert account_name not in self.accounts, 'account already registered'
+        assert address_type in PURPOSES, f'unknown address type {address_type}'
         account_number = len(self.accounts)
         account = {
             'account_number': account_number,
             'receiving_index': 0,
             'change_index': 0,
+            'address_type': address_type,
         }
         self.accounts[account_name] = account
+
+    def register_account(self, account_name, address_type='p2pkh'):
+        self.add_account(account_name, address_type)
         self.save()
 
-    def derive_key(self, account_name, change, address_index):
-        account = self.accounts[account_name]
-        account_number = account['account_number']
+    def address_type(self, account_name):
+        # accounts registered before segwit support are p2pkh
+        return self.accounts[account_name].get('address_type', 'p2pkh')
+
+    def chain_key(self, account_name, change):
+        account_number = self.accounts[account_name]['account_number']
+        purpose = PURPOSES[self.address_type(account_name)]
         change_number = int(change)
-        path_bytes = f"m/44'/1'/{account_number}'/{change_number}/{address_index}".encode()
+        path_bytes = f"m/{purpose}'/1'/{account_number}'/{change_number}".encode()
         return self.master_key.traverse(path_bytes)
 
+    def derive_key(self, account_name, change, address_index):
+        return self.chain_key(account_name, change).traverse(f'm/{address_index}'.encode())
+
     def keys(self, account_name):
         keys = []
         account = self.accounts[account_name]
-        # receiving addresses
-        for address_index in range(account['receiving_index']):
-            key = self.derive_key(account_name, False, address_index)
-            keys.append(key)
-        # change addresses
-        for address_index in range(account['change_index']):
-            key = self.derive_key(account_name, True, address_index)
-            keys.append(key)
+        # derive down to each chain once, then one step per address
+        for change, stop in ((False, account['receiving_index']), (True, account['change_index'])):
+            chain_key = self.chain_key(account_name, change)
+            for address_index in range(stop):
+                keys.append(chain_key.traverse(f'm/{address_index}'.encode()))
         return keys
 
-    def lookup_key(self, account_name, address):
-        for key in self.keys(account_name):
-            if key.pub.point.address(testnet=True) == address:
-                return key
+    def keys_by_address(self, account_name):
+        # build once per transaction, not once per input
+        keys = self.keys(account_name)
+        return dict(zip(addresses([key.pub.point for key in keys], address_type=self.address_type(account_name)), keys))
+
+    def lookup_key(self, account_name, output_address):
+        return self.keys_by_address(account_name).get(output_address)
 
     def addresses(self, account_name):
-        return [key.pub.point.address(testnet=True) for key in self.keys(account_name)]
+        return addresses([key.pub.point for key in self.keys(account_name)], address_type=self.address_type(account_name))
 
     def consume_address(self, account_name, change):
         # TODO
@@ -104,51 +186,157 @@ class Wallet:
             account['receiving_index'] += 1
         key = self.derive_key(account_name, change, address_index)
         self.save()
-        return key.pub.point.address(testnet=True)
+        return address(key.pub.point, address_type=self.address_type(account_name))
+
+    def utxo_store(self, account_name):
+        return self.utxos.setdefault(account_name, UtxoStore())
 
     def balance(self, account_name):
         return get_balance(self.addresses(account_name))
 
+    def sync(self, account_name):
+        self.utxo_store(account_name).sync(get_unspent(self.addresses(account_name)))
+        self.save()
+
     def unspent(self, account_name):
-        return get_unspent(self.addresses(account_name))
+        # our view of the backend's utxos, minus what we've spent since
+        if self.utxo_store(account_name).stale(self.sync_interval):
+            self.sync(account_name)
+        return self.utxo_store(account_name).unspent()
+
+    def spendable(self, account_name, spend_unconfirmed=False):
+        self.unspent(account_name)
+        if not spend_unconfirmed:
+            return self.utxo_store(account_name).spendable()
+        return self.utxo_store(account_name).spendable(self.max_ancestors, self.max_ancestor_size)
+
+    def within_ancestor_limits(self, account_name, utxos, size):
+        return self.utxo_store(account_name).within_limits(utxos, size, self.max_ancestors, self.max_ancestor_size)
+
+    def select(self, unspent, amount, fee, strategy, fee_rate, script_pubkeys, address_type):
+        # returns (selected, fee)
+        if fee_rate is None:
+            return select_coins(unspent, amount + fee, strategy), fee
+        return select_coins_by_fee_rate(unspent, amount, script_pubkeys, fee_rate, strategy, address_type)
 
     def transactions(self, account_name):
         return get_transactions(self.addresses(account_name))
 
-    def send(self, account_name, address, amount, fee):
+    def send(self, account_name, address, amount, fee=None, strategy='bnb', fee_rate=None, spend_unconfirmed=False):
+        return self.send_many(account_name, [(address, amount)], fee, strategy, fee_rate, spend_unconfirmed)
+
+    def send_many(self, account_name, payments, fee=None, strategy='bnb', fee_rate=None, spend_unconfirmed=False):
+        assert (fee is None) != (fee_rate is None), 'pass either fee or fee_rate'
+        address_type = self.address_type(account_name)
+        send_script_pubkeys = [script_pubkey(address) for address, _ in payments]
+        amount = sum(amount for _, amount in payments)
+
+        # choose which coins to spend
+        selected, fee = self.select(self.spendable(account_name, spend_unconfirmed), amount, fee,
+                                    strategy, fee_rate, send_script_pubkeys, address_type)
+        # several unconfirmed coins together can break the ancestor limits
+        # each is within. fall back to confirmed ones
+        if spend_unconfirmed and selected is not None:
+            output_sizes = [output_size(send_script_pubkey) for send_script_pubkey in send_script_pubkeys]
+            size = estimate_size(len(selected), output_sizes + [OUTPUT_SIZES[address_type]], address_type)
+            if not self.within_ancestor_limits(account_name, selected, size):
+                selected, fee = self.select(self.spendable(account_name), amount, fee,
+                                            strategy, fee_rate, send_script_pubkeys, address_type)
+
+        # make sure we have enough
+        assert selected is not None, 'Insufficient funds'
+        input_sum = sum(utxo['amount'] for utxo in selected)
+
+        # construct outputs, one per payment plus change
+        tx_outs = []
+        for send_script_pubkey, (_, payment_amount) in zip(send_script_pubkeys, payments):
+            send_output = TxOut(script_pubkey=send_script_pubkey, amount=payment_amount)
+            tx_outs.append(send_output)
+        change_amount = input_sum - amount - fee
+        # with a fee rate, the change output has to pay for its own bytes
+        if fee_rate is not None:
+            change_amount -= change_fee(fee_rate, address_type)
+        # leftovers too small for a change output go to the miners
+        change_address = None
+        if change_amount > DUST:
+            change_address = self.consume_address(account_name, True)
+            change_script_pubkey = script_pubkey(change_address)
+            change_output = TxOut(script_pubkey=change_script_pubkey, amount=change_amount)
+            tx_outs.append(change_output)
+
+        return self.spend(account_name, selected, tx_outs, change_address)
+
+    def consolidate(self, account_name, fee_rate, max_size=MAX_STANDARD_SIZE, count=None, spend_unconfirmed=False):
+        # smallest coins first, skipping any that cost more to spend than they're worth
+        address_type = self.address_type(account_name)
+        input_fee = fee_for(INPUT_SIZES[address_type], fee_rate)
+        unspent = sorted(self.spendable(account_name, spend_unconfirmed), key=lambda utxo: utxo['amount'])
+        unspent = [utxo for utxo in unspent if utxo['amount'] > input_fee]
+        if count is not None:
+            unspent = unspent[:count]
+
+        # sweep each chunk that fits in max_size into one of our change addresses
+        output_sizes = [OUTPUT_SIZES[address_type]]
+        chunk_size = max_inputs(max_size, output_sizes, address_type)
+        assert chunk_size >= 2, 'max_size too small to consolidate anything'
+        txids = []
+        for start in range(0, len(unspent), chunk_size):
+            chunk = unspent[start:start + chunk_size]
+            # nothing to gain from "consolidating" a single coin
+            # drop unconfirmed coins until the chunk as a whole fits the ancestor limits
+            while not self.within_ancestor_limits(account_name, chunk, estimate_size(len(chunk), output_sizes, address_type)):
+                chunk.remove(max(chunk, key=lambda utxo: utxo.get('ancestor_size', 0)))
+            if len(chunk) < 2:
+                break
+            fee = fee_for(estimate_size(len(chunk), output_sizes, address_type), fee_rate)
+            amount = sum(utxo['amount'] for utxo in chunk) - fee
+            if amount <= DUST:
+                break
+            change_address = self.consume_address(account_name, True)
+            tx_outs = [TxOut(script_pubkey=script_pubkey(change_address), amount=amount)]
+            txids.append(self.spend(account_name, chunk, tx_outs, change_address))
+        return txids
+
+    def spend(self, account_name, utxos, tx_outs, change_address=None):
+        # change_address, if given, is paid by the last output
+
         # collect inputs and private keys needed to sign these inputs
-        unspent = self.unspent(account_name)
         tx_ins = []
         private_keys = []
-        input_sum = 0
-        for utxo in unspent:
-            input_sum += utxo['amount']
+        keys = self.keys_by_address(account_name)
+        for utxo in utxos:
             tx_in = TxIn(utxo['prev_tx'], utxo['prev_index'])
             tx_ins.append(tx_in)
-            hd_private_key = self.lookup_key(account_name, utxo['address'])
+            hd_private_key = keys[utxo['address']]
             private_keys.append(hd_private_key.private_key)
-            # stop once we have enough inputs to transfer "amount"
-            if input_sum >= amount + fee:
-                break
-
-        # make sure we have enough
-        assert input_sum >= amount + fee, 'Insufficient funds'
-
-        # construct outputs
-        send_script_pubkey = address_to_script_pubkey(address)
-        send_output = TxOut(script_pubkey=send_script_pubkey, amount=amount)
-        change_amount = input_sum - amount - fee
-        change_script_pubkey = address_to_script_pubkey(self.consume_address(account_name, True))
-        change_output = TxOut(script_pubkey=change_script_pubkey, amount=change_amount)
-        tx_outs = [send_output, change_output]
 
         # construct transaction
         tx = Tx(1, tx_ins, tx_outs, 0, True)
 
         # sign
-        for index, private_key in enumerate(private_keys):
-            assert tx.sign_input(index, private_key)
-        
-        # broadcast
-        rawtx = tx.serialize().hex()
-        return broadcast(rawtx)
+        if self.address_type(account_name) == 'p2wpkh':
+            sign_segwit_transaction(tx, private_keys, [utxo['amount'] for utxo in utxos])
+        else:
+            sign_transaction(tx, private_keys)
+
+        # don't wait for the backend: mark inputs spent and track our change now
+        rawtx = serialize_witness(tx).hex()
+        store = self.utxo_store(account_name)
+        store.mark_spent(utxos)
+        change = None
+        if change_address is not None:
+            change_index = len(tx_outs) - 1
+            change_amount = tx_outs[change_index].amount
+            change = store.add(bytes.fromhex(tx.id()), change_index, change_amount, change_address,
+                               spent=utxos, size=vsize(tx))
+        self.save()
+
+        # broadcast, undoing the above if it's rejected or never got there
+        try:
+            return broadcast(rawtx)
+        except Exception:
+            store.unmark_spent(utxos)
+            if change is not None:
+                store.remove(change)
+            self.save()
+            raise
@@ -1,8 +1,15 @@
 import argparse
+import csv
+import json
 import logging
 
 from pprint import pprint
 from wallet_final import Wallet
+from scheduler import PaymentQueue
+from coin_selection import STRATEGIES
+from fees import MAX_STANDARD_SIZE, wait_for_fee_rate
+from services import get_fee_estimate
+import address_cache
 
 def create_command(args):
     wallet = Wallet.create(args.size)
@@ -23,18 +30,76 @@ def unspent_command(args):
     unspent = args.wallet.unspent()
     pprint(unspent)
 
+def sync_command(args):
+    args.wallet.sync()
+    pprint(args.wallet.unspent())
+
 def transactions_command(args):
     transactions = args.wallet.transactions()
     ids = [tx['txid'] for tx in transactions]
     pprint(ids)
 
-def send_command(args, wallet):
-    response = wallet.send(args.address, args.amount, args.fee)
+def send_command(args):
+    response = args.wallet.send(args.address, args.amount, args.fee, args.coin_selection, args.fee_rate, args.spend_unconfirmed)
+    print(response)
+
+def read_payments(filename):
+    # JSON list of [address, amount] pairs, or CSV rows of address,amount
+    with open(filename, 'r') as f:
+        if filename.endswith('.json'):
+            rows = json.load(f)
+        else:
+            rows = [row for row in csv.reader(f) if row]
+    return [(address, int(amount)) for address, amount in rows]
+
+def send_many_command(args):
+    payments = read_payments(args.payments)
+    response = args.wallet.send_many(payments, args.fee, args.coin_selection, args.fee_rate, args.spend_unconfirmed)
     print(response)
 
+def consolidate_command(args):
+    fee_rate = args.fee_rate
+    # wait for a quiet mempool, then pay whatever the going rate is
+    if args.max_fee_rate is not None:
+        fee_rate = wait_for_fee_rate(get_fee_estimate, args.max_fee_rate, args.poll_interval)
+    # don't keep other commands waiting on the wallet while we wait on fees
+    with Wallet.locked() as wallet:
+        txids = wallet.consolidate(fee_rate, args.max_size, args.count, args.spend_unconfirmed)
+    pprint(txids)
+
+def pay_command(args):
+    receipt = PaymentQueue().add(args.address, args.amount)
+    print(receipt)
+
+def receipt_command(args):
+    queue = PaymentQueue()
+    payment = queue.lookup(args.receipt)
+    # "sending" after a crash means the batch may or may not have gone out
+    print(payment['txid'] or queue.status(payment))
+
+def batch_sender(args):
+    # "schedule" runs for as long as you let it, so open the wallet afresh for
+    # every batch instead of saving the copy it started with over whatever
+    # other commands changed since
+    def send_many(payments):
+        with Wallet.locked() as wallet:
+            return wallet.send_many(payments, fee_rate=args.fee_rate)
+    return send_many
+
+def flush_command(args):
+    queue = PaymentQueue()
+    if args.retry_failed:
+        queue.retry()
+    if args.force or queue.due(args.window, args.max_outputs):
+        print(queue.flush(batch_sender(args), args.max_outputs))
+
+def schedule_command(args):
+    PaymentQueue().schedule(batch_sender(args), args.window, args.max_outputs)
+
 def parse_args():
     parser = argparse.ArgumentParser(description='Simple CLI Wallet')
     parser.add_argument('--debug', help='Print debug statements', action='store_true')
+    parser.add_argument('--address-cache', help='file to persist encoded addresses in')
     subparsers = parser.add_subparsers(help='sub-command help')
 
     # create
@@ -58,13 +123,67 @@ def parse_args():
     unspent = subparsers.add_parser('unspent', help='unspent transaction outputs')
     unspent.set_defaults(func=unspent_command)
 
+    # sync
+    sync = subparsers.add_parser('sync', help='refresh unspent outputs from the backend')
+    sync.set_defaults(func=sync_command)
+
     # "send"
     send = subparsers.add_parser('send', help='send bitcoins')
     send.add_argument('address', help='recipient\'s bitcoin address')
     send.add_argument('amount', type=int, help='how many satoshis to send')
-    send.add_argument('fee', type=int, help='fee in satoshis')
+    send.add_argument('fee', type=int, nargs='?', help='fee in satoshis')
+    send.add_argument('--fee-rate', type=float, help='fee rate in satoshis per vbyte, instead of a fixed fee')
+    send.add_argument('--coin-selection', choices=list(STRATEGIES), default='bnb', help='how to choose which coins to spend')
+    send.add_argument('--spend-unconfirmed', action='store_true', help='allow spending our own unconfirmed change')
     send.set_defaults(func=send_command)
 
+    # "send-many"
+    send_many = subparsers.add_parser('send-many', help='pay many recipients in one transaction')
+    send_many.add_argument('payments', help='CSV or JSON file of address,amount pairs')
+    send_many.add_argument('fee', type=int, nargs='?', help='fee in satoshis')
+    send_many.add_argument('--fee-rate', type=float, help='fee rate in satoshis per vbyte, instead of a fixed fee')
+    send_many.add_argument('--coin-selection', choices=list(STRATEGIES), default='bnb', help='how to choose which coins to spend')
+    send_many.add_argument('--spend-unconfirmed', action='store_true', help='allow spending our own unconfirmed change')
+    send_many.set_defaults(func=send_many_command)
+
+    # consolidate
+    consolidate = subparsers.add_parser('consolidate', help='sweep small coins into fewer outputs')
+    fee_rate = consolidate.add_mutually_exclusive_group(required=True)
+    fee_rate.add_argument('--fee-rate', type=float, help='fee rate in satoshis per vbyte')
+    fee_rate.add_argument('--max-fee-rate', type=float, help='wait until the estimated fee rate (sat/vB) drops to this')
+    consolidate.add_argument('--poll-interval', type=int, default=600, help='seconds between fee estimates while waiting')
+    consolidate.add_argument('--max-size', type=int, default=MAX_STANDARD_SIZE, help='largest transaction to create, in vbytes')
+    consolidate.add_argument('--count', type=int, help='only sweep this many of the smallest coins')
+    consolidate.add_argument('--spend-unconfirmed', action='store_true', help='allow spending our own unconfirmed change')
+    consolidate.set_defaults(func=consolidate_command)
+
+    # pay
+    pay = subparsers.add_parser('pay', help='queue a payment for the next batch')
+    pay.add_argument('address', help='recipient\'s bitcoin address')
+    pay.add_argument('amount', type=int, help='how many satoshis to send')
+    pay.set_defaults(func=pay_command)
+
+    # receipt
+    receipt = subparsers.add_parser('receipt', help='txid of a queued payment')
+    receipt.add_argument('receipt', help='receipt printed by "pay"')
+    receipt.set_defaults(func=receipt_command)
+
+    # flush
+    flush = subparsers.add_parser('flush', help='send queued payments if the batch is due')
+    flush.add_argument('--fee-rate', type=float, required=True, help='fee rate in satoshis per vbyte')
+    flush.add_argument('--window', type=int, default=60, help='send once the oldest payment has waited this many seconds')
+    flush.add_argument('--max-outputs', type=int, default=100, help='send once this many payments are queued')
+    flush.add_argument('--force', action='store_true', help='send now, even if the batch isn\'t due')
+    flush.add_argument('--retry-failed', action='store_true', help='queue payments from failed batches again first')
+    flush.set_defaults(func=flush_command)
+
+    # schedule
+    schedule = subparsers.add_parser('schedule', help='keep sending queued payments in batches')
+    schedule.add_argument('--fee-rate', type=float, required=True, help='fee rate in satoshis per vbyte')
+    schedule.add_argument('--window', type=int, default=60, help='send once the oldest payment has waited this many seconds')
+    schedule.add_argument('--max-outputs', type=int, default=100, help='send once this many payments are queued')
+    schedule.set_defaults(func=schedule_command)
+
     # parse
     args = parser.parse_args()
 
@@ -80,8 +199,22 @@ def main():
     # configure logger
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.WARNING)
 
-    # exercise callback
-    args.func(args)
+    # reuse addresses encoded by previous runs
+    if args.address_cache:
+        address_cache.persist(args.address_cache)
+
+    # exercise callback. other processes can't save the wallet until it's
+    # done, or they'd undo each other's changes. commands that run for long
+    # lock it only while they use it, and those that don't need it not at all
+    if args.func in (create_command, consolidate_command, pay_command, receipt_command, flush_command, schedule_command):
+        args.func(args)
+    else:
+        with Wallet.locked() as args.wallet:
+            args.func(args)
+
+    # save address cache and report hit rate
+    address_cache.cache.save()
+    logging.debug(f'address cache: {address_cache.cache_info()}')
 
 if __name__ == '__main__':
     main()
@@ -3,25 +3,41 @@
 - Perhaps bedrock needs a PrivateKey.generate() classmethod?
 - Add more logging statements
 '''
+import fcntl
 import json
 
 from os.path import isfile
+from contextlib import contextmanager
 from random import randint
 
-from bedrock.ecc import N, PrivateKey
+from bedrock.ecc import N
 from bedrock.tx import Tx, TxIn, TxOut
 from bedrock.script import address_to_script_pubkey
 
 from services import get_balance, get_unspent, get_transactions, broadcast
+from address_cache import address, addresses
+from coin_selection import DUST, select_coins
+from fees import (MAX_STANDARD_SIZE, P2PKH_INPUT_SIZE, P2PKH_OUTPUT_SIZE, change_fee,
+                  estimate_size, fee_for, max_inputs, output_size, select_coins_by_fee_rate)
+from signing import sign_transaction
+from utxo_store import UtxoStore
+from ecc_backend import private_key
 
 class Wallet:
 
     filename = "wallet.json"
+    # seconds before unspent() asks the backend again
+    sync_interval = 60
+    # limits on chaining sends onto our own unconfirmed change, matching
+    # bitcoind's default -limitancestorcount and -limitancestorsize
+    max_ancestors = 25
+    max_ancestor_size = 101_000
 
-    def __init__(self, keys, size, index):
+    def __init__(self, keys, size, index, utxos=None):
         self.keys = keys
         self.size = size
         self.index = index
+        self.utxos = utxos or UtxoStore()
 
     @classmethod
     def create(cls, size):
@@ -38,6 +54,7 @@ class Wallet:
             'secrets': [key.secret for key in self.keys],
             'size': self.size,
             'index': self.index,
+            'utxos': self.utxos.serialize(),
         }
         return json.dumps(dict, indent=4)
 
@@ -49,8 +66,9 @@ class Wallet:
     @classmethod
     def deserialize(cls, raw_json):
         data = json.loads(raw_json)
-        keys = [PrivateKey(secret) for secret in data['secrets']]
-        return cls(keys, data['size'], data['index'])
+        keys = [private_key(secret) for secret in data['secrets']]
+        utxos = UtxoStore.deserialize(data['utxos']) if 'utxos' in data else None
+        return cls(keys, data['size'], data['index'], utxos)
 
     @classmethod
     def open(cls):
@@ -58,19 +76,31 @@ class Wallet:
             raw_json = f.read()
             return cls.deserialize(raw_json)
 
+    @classmethod
+    @contextmanager
+    def locked(cls):
+        # open the wallet and keep other processes from saving it until we're
+        # done. whoever saves last wins, so a process saving a copy it opened
+        # earlier would undo keys handed out and spends marked in between
+        with open(cls.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield cls.open()
+
     def addresses(self):
         keys = self.keys[:self.index]
-        return [key.point.address(testnet=True) for key in keys]
+        return addresses([key.point for key in keys])
 
-    def lookup_key(self, address):
-        for key in self.keys:
-            if key.point.address(testnet=True) == address:
-                return key
+    def keys_by_address(self):
+        # build once per transaction, not once per input
+        return dict(zip(addresses([key.point for key in self.keys]), self.keys))
+
+    def lookup_key(self, output_address):
+        return self.keys_by_address().get(output_address)
 
     def generate_keys(self):
         for _ in range(self.size):
             secret = randint(1, N)
-            key = PrivateKey(secret)
+            key = private_key(secret)
             self.keys.append(key)
         self.save()
 
@@ -83,51 +113,146 @@ class Wallet:
         self.index += 1
         self.save()
         # return testnet address
-        return key.point.address(testnet=True)
+        return address(key.point)
 
     def balance(self):
         return get_balance(self.addresses())
 
+    def sync(self):
+        self.utxos.sync(get_unspent(self.addresses()))
+        self.save()
+
     def unspent(self):
-        return get_unspent(self.addresses())
+        # our view of the backend's utxos, minus what we've spent since
+        if self.utxos.stale(self.sync_interval):
+            self.sync()
+        return self.utxos.unspent()
+
+    def spendable(self, spend_unconfirmed=False):
+        self.unspent()
+        if not spend_unconfirmed:
+            return self.utxos.spendable()
+        return self.utxos.spendable(self.max_ancestors, self.max_ancestor_size)
+
+    def within_ancestor_limits(self, utxos, size):
+        return self.utxos.within_limits(utxos, size, self.max_ancestors, self.max_ancestor_size)
+
+    def select(self, unspent, amount, fee, strategy, fee_rate, script_pubkeys):
+        # returns (selected, fee)
+        if fee_rate is None:
+            return select_coins(unspent, amount + fee, strategy), fee
+        return select_coins_by_fee_rate(unspent, amount, script_pubkeys, fee_rate, strategy)
 
     def transactions(self):
         return get_transactions(self.addresses())
 
-    def send(self, address, amount, fee):
+    def send(self, address, amount, fee=None, strategy='bnb', fee_rate=None, spend_unconfirmed=False):
+        return self.send_many([(address, amount)], fee, strategy, fee_rate, spend_unconfirmed)
+
+    def send_many(self, payments, fee=None, strategy='bnb', fee_rate=None, spend_unconfirmed=False):
+        assert (fee is None) != (fee_rate is None), 'pass either fee or fee_rate'
+        send_script_pubkeys = [address_to_script_pubkey(address) for address, _ in payments]
+        amount = sum(amount for _, amount in payments)
+
+        # choose which coins to spend
+        selected, fee = self.select(self.spendable(spend_unconfirmed), amount, fee, strategy, fee_rate, send_script_pubkeys)
+        # several unconfirmed coins together can break the ancestor limits
+        # each is within. fall back to confirmed ones
+        if spend_unconfirmed and selected is not None:
+            output_sizes = [output_size(send_script_pubkey) for send_script_pubkey in send_script_pubkeys]
+            size = estimate_size(len(selected), output_sizes + [P2PKH_OUTPUT_SIZE])
+            if not self.within_ancestor_limits(selected, size):
+                selected, fee = self.select(self.spendable(), amount, fee, strategy, fee_rate, send_script_pubkeys)
+
+        # make sure we have enough
+        assert selected is not None, 'Insufficient funds'
+        input_sum = sum(utxo['amount'] for utxo in selected)
+
+        # construct outputs, one per payment plus change
+        tx_outs = []
+        for send_script_pubkey, (_, payment_amount) in zip(send_script_pubkeys, payments):
+            send_output = TxOut(script_pubkey=send_script_pubkey, amount=payment_amount)
+            tx_outs.append(send_output)
+        change_amount = input_sum - amount - fee
+        # with a fee rate, the change output has to pay for its own bytes
+        if fee_rate is not None:
+            change_amount -= change_fee(fee_rate)
+        # leftovers too small for a change output go to the miners
+        change_address = None
+        if change_amount > DUST:
+            change_address = self.consume_address()
+            change_script_pubkey = address_to_script_pubkey(change_address)
+            change_output = TxOut(script_pubkey=change_script_pubkey, amount=change_amount)
+            tx_outs.append(change_output)
+
+        return self.spend(selected, tx_outs, change_address)
+
+    def consolidate(self, fee_rate, max_size=MAX_STANDARD_SIZE, count=None, spend_unconfirmed=False):
+        # smallest coins first, skipping any that cost more to spend than they're worth
+        input_fee = fee_for(P2PKH_INPUT_SIZE, fee_rate)
+        unspent = sorted(self.spendable(spend_unconfirmed), key=lambda utxo: utxo['amount'])
+        unspent = [utxo for utxo in unspent if utxo['amount'] > input_fee]
+        if count is not None:
+            unspent = unspent[:count]
+
+        # sweep each chunk that fits in max_size into one of our change addresses
+        chunk_size = max_inputs(max_size, [P2PKH_OUTPUT_SIZE])
+        assert chunk_size >= 2, 'max_size too small to consolidate anything'
+        txids = []
+        for start in range(0, len(unspent), chunk_size):
+            chunk = unspent[start:start + chunk_size]
+            # nothing to gain from "consolidating" a single coin
+            # drop unconfirmed coins until the chunk as a whole fits the ancestor limits
+            while not self.within_ancestor_limits(chunk, estimate_size(len(chunk), [P2PKH_OUTPUT_SIZE])):
+                chunk.remove(max(chunk, key=lambda utxo: utxo.get('ancestor_size', 0)))
+            if len(chunk) < 2:
+                break
+            fee = fee_for(estimate_size(len(chunk), [P2PKH_OUTPUT_SIZE]), fee_rate)
+            amount = sum(utxo['amount'] for utxo in chunk) - fee
+            if amount <= DUST:
+                break
+            change_address = self.consume_address()
+            script_pubkey = address_to_script_pubkey(change_address)
+            tx_outs = [TxOut(script_pubkey=script_pubkey, amount=amount)]
+            txids.append(self.spend(chunk, tx_outs, change_address))
+        return txids
+
+    def spend(self, utxos, tx_outs, change_address=None):
+        # change_address, if given, is paid by the last output
+
         # collect inputs and private keys needed to sign these inputs
-        unspent = self.unspent()
         tx_ins = []
         private_keys = []
-        input_sum = 0
-        for utxo in unspent:
-            input_sum += utxo['amount']
+        keys = self.keys_by_address()
+        for utxo in utxos:
             tx_in = TxIn(utxo['prev_tx'], utxo['prev_index'])
             tx_ins.append(tx_in)
-            private_key = self.lookup_key(utxo['address'])
-            private_keys.append(private_key)
-            # stop once we have enough inputs to transfer "amount"
-            if input_sum >= amount + fee:
-                break
-
-        # make sure we have enough
-        assert input_sum >= amount + fee, 'Insufficient funds'
-
-        # construct outputs
-        send_script_pubkey = address_to_script_pubkey(address)
-        send_output = TxOut(script_pubkey=send_script_pubkey, amount=amount)
-        change_amount = input_sum - amount - fee
-        change_script_pubkey = address_to_script_pubkey(self.consume_address())
-        change_output = TxOut(script_pubkey=change_script_pubkey, amount=change_amount)
-        tx_outs = [send_output, change_output]
+            private_keys.append(keys[utxo['address']])
 
         # construct transaction
         tx = Tx(1, tx_ins, tx_outs, 0, True)
 
         # sign
-        for index, private_key in enumerate(private_keys):
-            assert tx.sign_input(index, private_key)
-        
-        # broadcast
+        sign_transaction(tx, private_keys)
+
+        # don't wait for the backend: mark inputs spent and track our change now
         rawtx = tx.serialize().hex()
-        return broadcast(rawtx)
+        store = self.utxos
+        store.mark_spent(utxos)
+        change = None
+        if change_address is not None:
+            change_index = len(tx_outs) - 1
+            change_amount = tx_outs[change_index].amount
+            change = store.add(bytes.fromhex(tx.id()), change_index, change_amount, change_address,
+                               spent=utxos, size=len(rawtx) // 2)
+        self.save()
+
+        # broadcast, undoing the above if it's rejected or never got there
+        try:
+            return broadcast(rawtx)
+        except Exception:
+            store.unmark_spent(utxos)
+            if change is not None:
+                store.remove(change)
+            self.save()
+            raise
@@ -0,0 +1,90 @@
+import json
+
+from collections import OrderedDict
+from os.path import isfile
+
+
+class AddressCache:
+
+    def __init__(self, maxsize=10_000, filename=None):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filename and isfile(filename):
+            self.load()
+
+    def address(self, point, testnet=True, address_type='p2pkh'):
+        # SEC serialization is cheap, hash160 + base58check/bech32 are what we're avoiding
+        key = (point.sec().hex(), testnet, address_type)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        if address_type == 'p2wpkh':
+            # only the lessons with segwit accounts ship segwit.py
+            from segwit import p2wpkh_address
+            address = p2wpkh_address(point, testnet)
+        else:
+            address = point.address(testnet=testnet)
+        self.entries[key] = address
+        # evict least recently used entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return address
+
+    def addresses(self, points, testnet=True, address_type='p2pkh'):
+        return [self.address(point, testnet, address_type) for point in points]
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+        for entry in data[-self.maxsize:]:
+            # files saved before segwit have no address type
+            if len(entry) == 3:
+                sec, testnet, address = entry
+                entry = [sec, testnet, 'p2pkh', address]
+            sec, testnet, address_type, address = entry
+            self.entries[(sec, testnet, address_type)] = address
+
+    def save(self):
+        if not self.filename:
+            return
+        data = [[sec, testnet, address_type, address]
+                for (sec, testnet, address_type), address in self.entries.items()]
+        with open(self.filename, 'w') as f:
+            json.dump(data, f)
+
+
+# shared by every wallet in this process
+cache = AddressCache()
+
+def address(point, testnet=True, address_type='p2pkh'):
+    return cache.address(point, testnet, address_type)
+
+def addresses(points, testnet=True, address_type='p2pkh'):
+    return cache.addresses(points, testnet, address_type)
+
+def cache_info():
+    return cache.info()
+
+def persist(filename):
+    # reuse addresses encoded by previous processes
+    cache.filename = filename
+    if isfile(filename):
+        cache.load()
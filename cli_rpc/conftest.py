@@ -0,0 +1,12 @@
+import pytest
+
+import fake_bitcoind
+import rpc_final
+
+
+@pytest.fixture
+def bitcoind():
+    # a fresh node per test, with nothing pooled or cached from the last one
+    with fake_bitcoind.FakeBitcoind() as bitcoind:
+        rpc_final.configure(bitcoind.url)
+        yield bitcoind
@@ -0,0 +1,36 @@
+INPUT_CHARSET = "0123456789()[],'/*abcdefgh@:$%{}IJKLMNOPQRSTUVWXYZ&+-.;<=>?!^_|~ijklmnopqrstuvwxyzABCDEFGH`#\"\\ "
+CHECKSUM_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+GENERATOR = [0xf5dee51989, 0xa9fdca3312, 0x1bab10e32d, 0x3706b1677a, 0x644d626ffd]
+
+
+def descriptor_polymod(symbols):
+    chk = 1
+    for value in symbols:
+        top = chk >> 35
+        chk = (chk & 0x7ffffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                chk ^= GENERATOR[i]
+    return chk
+
+def descriptor_expand(descriptor):
+    # 5 bits of each character, then the remaining 2 bits of every group of 3
+    groups = []
+    symbols = []
+    for c in descriptor:
+        value = INPUT_CHARSET.index(c)
+        symbols.append(value & 31)
+        groups.append(value >> 5)
+        if len(groups) == 3:
+            symbols.append(groups[0] * 9 + groups[1] * 3 + groups[2])
+            groups = []
+    if len(groups) == 1:
+        symbols.append(groups[0])
+    elif len(groups) == 2:
+        symbols.append(groups[0] * 3 + groups[1])
+    return symbols
+
+def add_checksum(descriptor):
+    symbols = descriptor_expand(descriptor) + [0] * 8
+    checksum = descriptor_polymod(symbols) ^ 1
+    return descriptor + '#' + ''.join(CHECKSUM_CHARSET[(checksum >> (5 * (7 - i))) & 31] for i in range(8))
@@ -0,0 +1,86 @@
+import logging
+import time
+
+from math import ceil
+
+from coin_selection import DUST, select_coins
+
+# outpoint (32 + 4) + scriptSig length (1) + scriptSig (107) + sequence (4)
+# scriptSig is a push of a <= 71 byte low-s DER signature plus sighash byte,
+# then a push of the 33 byte compressed SEC pubkey
+P2PKH_INPUT_SIZE = 32 + 4 + 1 + (1 + 72 + 1 + 33) + 4
+# amount (8) + script length (1) + OP_DUP OP_HASH160 <20 bytes> OP_EQUALVERIFY OP_CHECKSIG
+P2PKH_OUTPUT_SIZE = 8 + 1 + 25
+# p2wpkh inputs have an empty scriptSig, the same signature & pubkey move to
+# the witness where each byte counts a quarter: (1 + 1 + 72 + 1 + 33) / 4, rounded up
+P2WPKH_INPUT_SIZE = 32 + 4 + 1 + 4 + 27
+# amount (8) + script length (1) + OP_0 <20 bytes>
+P2WPKH_OUTPUT_SIZE = 8 + 1 + 22
+INPUT_SIZES = {'p2pkh': P2PKH_INPUT_SIZE, 'p2wpkh': P2WPKH_INPUT_SIZE}
+OUTPUT_SIZES = {'p2pkh': P2PKH_OUTPUT_SIZE, 'p2wpkh': P2WPKH_OUTPUT_SIZE}
+# bitcoind won't relay transactions bigger than this
+MAX_STANDARD_SIZE = 100_000
+
+logger = logging.getLogger(__name__)
+
+
+def varint_size(n):
+    if n < 0xfd:
+        return 1
+    elif n <= 0xffff:
+        return 3
+    elif n <= 0xffffffff:
+        return 5
+    return 9
+
+def output_size(script_pubkey):
+    # Script.serialize() includes the length prefix
+    return 8 + len(script_pubkey.serialize())
+
+def estimate_size(num_inputs, output_sizes, address_type='p2pkh'):
+    # version + input count + inputs + output count + outputs + locktime,
+    # plus the segwit marker & flag (half a vbyte, rounded up)
+    return (4 + varint_size(num_inputs) + num_inputs * INPUT_SIZES[address_type]
+            + varint_size(len(output_sizes)) + sum(output_sizes) + 4
+            + (1 if address_type == 'p2wpkh' else 0))
+
+def fee_for(size, fee_rate):
+    return ceil(size * fee_rate)
+
+def select_coins_by_fee_rate(utxos, amount, script_pubkeys, fee_rate, strategy='bnb', address_type='p2pkh'):
+    # fee depends on how many inputs we pick, so keep re-running selection
+    # until the selected inputs pay for themselves. returns (selected, fee)
+    # where fee doesn't yet include a change output
+    output_sizes = [output_size(script_pubkey) for script_pubkey in script_pubkeys]
+    # creating change costs an output now and an input later
+    cost_of_change = max(DUST, fee_for(OUTPUT_SIZES[address_type] + INPUT_SIZES[address_type], fee_rate))
+    num_inputs = 1
+    while num_inputs <= len(utxos):
+        fee = fee_for(estimate_size(num_inputs, output_sizes, address_type), fee_rate)
+        selected = select_coins(utxos, amount + fee, strategy, cost_of_change=cost_of_change)
+        if selected is None:
+            return None, None
+        fee = fee_for(estimate_size(len(selected), output_sizes, address_type), fee_rate)
+        if sum(utxo['amount'] for utxo in selected) >= amount + fee:
+            return selected, fee
+        num_inputs = max(num_inputs + 1, len(selected))
+    return None, None
+
+def change_fee(fee_rate, address_type='p2pkh'):
+    return fee_for(OUTPUT_SIZES[address_type], fee_rate)
+
+def max_inputs(max_size, output_sizes, address_type='p2pkh'):
+    # how many inputs fit in a transaction of at most max_size vbytes
+    num_inputs = (max_size - estimate_size(0, output_sizes, address_type)) // INPUT_SIZES[address_type]
+    while num_inputs > 0 and estimate_size(num_inputs, output_sizes, address_type) > max_size:
+        num_inputs -= 1
+    return num_inputs
+
+def wait_for_fee_rate(estimate_fee_rate, target, poll_interval=600):
+    # block until the estimated fee rate drops to target, then return it
+    while True:
+        fee_rate = estimate_fee_rate()
+        if fee_rate is not None and fee_rate <= target:
+            return fee_rate
+        logger.debug(f'fee rate {fee_rate} sat/vB above target {target}, waiting {poll_interval}s')
+        time.sleep(poll_interval)
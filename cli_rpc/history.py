@@ -0,0 +1,46 @@
+import json
+
+from os.path import isfile
+
+
+def entry_key(entry):
+    # one wallet transaction can both send and receive, on several outputs
+    return f"{entry['txid']}:{entry.get('vout', 0)}:{entry['category']}"
+
+
+class HistoryStore:
+    # per-account transaction history, kept up to date from listsinceblock
+    # so reading it doesn't cost any RPCs
+
+    filename = 'history.json'
+
+    def __init__(self, filename=None):
+        self.filename = filename or self.filename
+        self.load()
+
+    def load(self):
+        self.accounts = {}
+        if isfile(self.filename):
+            with open(self.filename, 'r') as f:
+                self.accounts = json.load(f)
+
+    def save(self):
+        with open(self.filename, 'w') as f:
+            json.dump(self.accounts, f, indent=4)
+
+    def transactions(self, account_name):
+        return list(self.accounts.get(account_name, {}).values())
+
+    def update(self, account_name, transactions, removed=()):
+        # new entries are appended, ones we already have (e.g. with more
+        # confirmations now) replaced in place, reorged out ones dropped
+        history = self.accounts.setdefault(account_name, {})
+        for entry in removed:
+            history.pop(entry_key(entry), None)
+        added = []
+        for entry in transactions:
+            key = entry_key(entry)
+            if key not in history:
+                added.append(entry)
+            history[key] = entry
+        return added
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from io import BytesIO
+
+from bedrock.script import p2pkh_script
+from bedrock.tx import Tx
+
+from address_cache import address
+from segwit import p2wpkh_script
+from signing import strip_witness
+from rpc_final import WalletRPC, btc_to_sat
+
+logger = logging.getLogger(__name__)
+
+# bitcoind -zmqpubrawtx=tcp://127.0.0.1:28332 -zmqpubhashblock=tcp://127.0.0.1:28332
+DEFAULT_ZMQ_URL = 'tcp://127.0.0.1:28332'
+
+
+class ZMQFeed:
+    # bitcoind's zmq notifications. needs pyzmq
+
+    def __init__(self, url=DEFAULT_ZMQ_URL, topics=(b'rawtx', b'hashblock')):
+        import zmq
+        self.zmq = zmq
+        self.socket = zmq.Context.instance().socket(zmq.SUB)
+        for topic in topics:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic)
+        self.socket.connect(url)
+
+    def receive(self, timeout=None):
+        # (topic, body), or None if nothing arrived within timeout seconds
+        if not self.socket.poll(None if timeout is None else int(timeout * 1000)):
+            return None
+        # the third part is a sequence number we don't need
+        topic, body, _ = self.socket.recv_multipart()
+        return topic, body
+
+    def close(self):
+        self.socket.close()
+
+
+class LocalPublisher:
+    # stand-in for bitcoind's zmq publisher, feeding a subscriber in the same
+    # process. like bitcoind it announces a transaction once when it enters
+    # the mempool and again when a block confirms it
+
+    def __init__(self):
+        self.messages = queue.Queue()
+
+    def publish(self, topic, body):
+        self.messages.put((topic, body))
+
+    def publish_tx(self, tx):
+        self.publish(b'rawtx', tx.serialize())
+
+    def publish_block(self, txs, block_hash):
+        for tx in txs:
+            self.publish_tx(tx)
+        self.publish(b'hashblock', block_hash)
+
+    def replay(self, txs, block_hash=None, interval=0):
+        # fixture transactions into the mempool, then optionally a block with all of them
+        for tx in txs:
+            self.publish_tx(tx)
+            time.sleep(interval)
+        if block_hash is not None:
+            self.publish_block(txs, block_hash)
+
+    def receive(self, timeout=None):
+        try:
+            return self.messages.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        pass
+
+
+class Subscriber:
+    # keeps an account's UTXOs and balance up to date from rawtx/hashblock
+    # notifications, matching outputs against the account's scriptPubKeys.
+    # one listunspent to start with, no polling after that
+
+    def __init__(self, wallet, account_name, feed):
+        self.wallet = wallet
+        self.account_name = account_name
+        self.feed = feed
+        self.lock = threading.Lock()
+        # outpoint (txid, vout) -> {'txid', 'vout', 'address', 'amount' (sats), 'confirmed'}
+        self.utxos = {}
+        # our txids announced once already, the next announcement means a block has them
+        self.mempool = set()
+        # script_pubkey bytes -> address, for every address exported to bitcoind
+        self.script_pubkeys = {}
+        self.watched = {False: 0, True: 0}
+        self.callbacks = []
+        self.running = False
+        self.thread = None
+
+    def watch(self):
+        # derive scriptPubKeys for whatever the wallet exported since last time
+        address_type = self.wallet.address_type(self.account_name)
+        make_script = p2wpkh_script if address_type == 'p2wpkh' else p2pkh_script
+        for change in (False, True):
+            stop = self.wallet.exported(self.account_name, change)
+            for address_index in range(self.watched[change], stop):
+                key = self.wallet.derive_key(self.account_name, change, address_index)
+                script_pubkey = make_script(key.pub.point.hash160()).serialize()
+                self.script_pubkeys[script_pubkey] = address(key.pub.point, address_type=address_type)
+            self.watched[change] = max(self.watched[change], stop)
+
+    def load(self):
+        for utxo in WalletRPC(self.account_name).get_unspent(0):
+            self.utxos[(utxo['txid'], utxo['vout'])] = {
+                'txid': utxo['txid'],
+                'vout': utxo['vout'],
+                'address': utxo['address'],
+                'amount': btc_to_sat(utxo['amount']),
+                'confirmed': utxo['confirmations'] > 0,
+            }
+            if not utxo['confirmations']:
+                self.mempool.add(utxo['txid'])
+
+    def confirm(self):
+        # a block can confirm transactions we never saw enter the mempool
+        confirmed = {(utxo['txid'], utxo['vout']) for utxo in WalletRPC(self.account_name).get_unspent(1)}
+        with self.lock:
+            for outpoint, utxo in self.utxos.items():
+                if outpoint in confirmed:
+                    utxo['confirmed'] = True
+
+    def balance(self):
+        # (unconfirmed, confirmed), like Wallet.balance
+        with self.lock:
+            confirmed = sum(utxo['amount'] for utxo in self.utxos.values() if utxo['confirmed'])
+            unconfirmed = sum(utxo['amount'] for utxo in self.utxos.values() if not utxo['confirmed'])
+        return unconfirmed, confirmed
+
+    def unspent(self):
+        with self.lock:
+            return list(self.utxos.values())
+
+    def on_update(self, callback):
+        # callback(event) runs on the subscriber thread for every change
+        self.callbacks.append(callback)
+
+    def emit(self, event):
+        for callback in self.callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.exception('notification callback failed')
+
+    def handle_tx(self, raw):
+        # rawtx notifications carry witnesses, Tx.parse doesn't know them
+        tx = Tx.parse(BytesIO(strip_witness(raw)), testnet=True)
+        txid = tx.id()
+        confirmed = txid in self.mempool
+        # the wallet may have exported more addresses since we started
+        self.watch()
+        spent = []
+        received = []
+        with self.lock:
+            for tx_in in tx.tx_ins:
+                utxo = self.utxos.pop((tx_in.prev_tx.hex(), tx_in.prev_index), None)
+                if utxo:
+                    spent.append(utxo)
+            for vout, tx_out in enumerate(tx.tx_outs):
+                output_address = self.script_pubkeys.get(tx_out.script_pubkey.serialize())
+                if output_address is None:
+                    continue
+                utxo = self.utxos.get((txid, vout))
+                if utxo is None and confirmed:
+                    # already spent by a transaction we've seen
+                    continue
+                if utxo is None:
+                    utxo = self.utxos[(txid, vout)] = {
+                        'txid': txid,
+                        'vout': vout,
+                        'address': output_address,
+                        'amount': tx_out.amount,
+                        'confirmed': confirmed,
+                    }
+                    received.append(utxo)
+                elif confirmed and not utxo['confirmed']:
+                    utxo['confirmed'] = True
+                    received.append(utxo)
+        if confirmed:
+            self.mempool.discard(txid)
+        elif spent or received:
+            self.mempool.add(txid)
+        if spent or received:
+            self.emit({'type': 'tx', 'txid': txid, 'confirmed': confirmed,
+                       'received': received, 'spent': spent, 'balance': self.balance()})
+
+    def handle_block(self, block_hash):
+        # only costs an RPC while something is still unconfirmed
+        if any(not utxo['confirmed'] for utxo in self.unspent()):
+            self.confirm()
+        self.emit({'type': 'block', 'hash': block_hash.hex(), 'balance': self.balance()})
+
+    def handle(self, topic, body):
+        if topic == b'rawtx':
+            self.handle_tx(body)
+        elif topic == b'hashblock':
+            self.handle_block(body)
+
+    def run(self):
+        while self.running:
+            message = self.feed.receive(timeout=0.5)
+            if message is None:
+                continue
+            # one bad message or failed RPC mustn't stop the updates
+            try:
+                self.handle(*message)
+            except Exception:
+                logger.exception(f'handling {message[0].decode()} notification failed')
+
+    def start(self):
+        self.watch()
+        self.load()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.feed.close()
+
+    def events(self):
+        # async for event in subscriber.events(): ...
+        # registers right away, so nothing emitted before the first
+        # iteration gets lost
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+        def callback(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        self.on_update(callback)
+        return self.iterate(events, callback)
+
+    async def iterate(self, events, callback):
+        try:
+            while True:
+                yield await events.get()
+        finally:
+            self.callbacks.remove(callback)
@@ -0,0 +1,86 @@
+from bedrock.script import Script, address_to_script_pubkey
+
+# BIP173
+CHARSET = 'qpzry9x8gf2tvdw0s3jn54khce6mua7l'
+GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+
+def bech32_polymod(values):
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            if (top >> i) & 1:
+                chk ^= GENERATOR[i]
+    return chk
+
+def hrp_expand(hrp):
+    return [ord(c) >> 5 for c in hrp] + [0] + [ord(c) & 31 for c in hrp]
+
+def convert_bits(data, from_bits, to_bits, pad=True):
+    acc = 0
+    bits = 0
+    result = []
+    maxv = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            result.append((acc >> bits) & maxv)
+    if pad and bits:
+        result.append((acc << (to_bits - bits)) & maxv)
+    elif not pad:
+        assert bits < from_bits and not (acc << (to_bits - bits)) & maxv, 'invalid padding'
+    return result
+
+def hrp(testnet):
+    return 'tb' if testnet else 'bc'
+
+def encode_segwit_address(version, program, testnet=True):
+    data = [version] + convert_bits(program, 8, 5)
+    polymod = bech32_polymod(hrp_expand(hrp(testnet)) + data + [0] * 6) ^ 1
+    checksum = [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+    return hrp(testnet) + '1' + ''.join(CHARSET[d] for d in data + checksum)
+
+def decode_segwit_address(address):
+    # (version, program) of a bech32 address
+    assert address.lower() == address or address.upper() == address, 'mixed case bech32 address'
+    assert len(address) <= 90, 'bech32 address too long'
+    address = address.lower()
+    prefix, _, rest = address.rpartition('1')
+    # a witness version and the checksum at least
+    assert prefix in ('bc', 'tb') and len(rest) >= 7, 'not a segwit address'
+    assert all(c in CHARSET for c in rest), 'invalid bech32 character'
+    data = [CHARSET.index(c) for c in rest]
+    assert bech32_polymod(hrp_expand(prefix) + data) == 1, 'invalid bech32 checksum'
+    version = data[0]
+    program = bytes(convert_bits(data[1:-6], 5, 8, pad=False))
+    # only v0 uses bech32, later versions are bech32m (BIP350)
+    assert version == 0 and len(program) in (20, 32), 'unsupported witness program'
+    return version, program
+
+def is_segwit_address(address):
+    return address.lower().startswith(('bc1', 'tb1'))
+
+def p2wpkh_script(h160):
+    # OP_0 <20 byte hash>
+    return Script([0, h160])
+
+def p2wpkh_address(point, testnet=True):
+    return encode_segwit_address(0, point.hash160(), testnet)
+
+def script_pubkey(address):
+    # like address_to_script_pubkey, but bech32 addresses work too
+    if is_segwit_address(address):
+        version, program = decode_segwit_address(address)
+        return Script([version, program])
+    return address_to_script_pubkey(address)
+
+def script_address(script_pubkey, testnet=True):
+    # like Script.address, but v0 witness programs work too
+    raw = script_pubkey.serialize()[1:]
+    if raw[0] == 0 and len(raw) in (22, 34) and raw[1] == len(raw) - 2:
+        return encode_segwit_address(0, raw[2:], testnet)
+    return script_pubkey.address(testnet=testnet)
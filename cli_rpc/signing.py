@@ -0,0 +1,230 @@
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from io import BytesIO
+from random import randint
+
+from bedrock.ecc import N, PrivateKey
+from bedrock.helper import SIGHASH_ALL, encode_varint, hash256, int_to_little_endian, read_varint
+from bedrock.script import Script, p2pkh_script
+from bedrock.tx import Tx, TxIn, TxOut
+
+# below this many inputs, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 16
+
+
+def legacy_sig_hash(tx, input_index, script_pubkey):
+    # same as Tx.sig_hash, but we already know the script_pubkey being spent
+    # so there's no need to fetch the previous transaction
+    s = int_to_little_endian(tx.version, 4)
+    s += encode_varint(len(tx.tx_ins))
+    for index, tx_in in enumerate(tx.tx_ins):
+        script_sig = script_pubkey if index == input_index else Script()
+        s += TxIn(
+            prev_tx=tx_in.prev_tx,
+            prev_index=tx_in.prev_index,
+            script_sig=script_sig,
+            sequence=tx_in.sequence,
+        ).serialize()
+    s += encode_varint(len(tx.tx_outs))
+    for tx_out in tx.tx_outs:
+        s += tx_out.serialize()
+    s += int_to_little_endian(tx.locktime, 4)
+    s += int_to_little_endian(SIGHASH_ALL, 4)
+    return int.from_bytes(hash256(s), 'big')
+
+def legacy_sig_hashes(tx, script_pubkeys):
+    # legacy_sig_hash for every input at once. each preimage differs from the
+    # others only in which input carries its script_pubkey, so serialize every
+    # piece once and share one sha256 state for the prefix before that input
+    empty_tx_ins = []
+    signing_tx_ins = []
+    for tx_in, script_pubkey in zip(tx.tx_ins, script_pubkeys):
+        empty_tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, Script(), tx_in.sequence).serialize())
+        signing_tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, script_pubkey, tx_in.sequence).serialize())
+    suffix = encode_varint(len(tx.tx_outs))
+    suffix += b''.join(tx_out.serialize() for tx_out in tx.tx_outs)
+    suffix += int_to_little_endian(tx.locktime, 4)
+    suffix += int_to_little_endian(SIGHASH_ALL, 4)
+
+    # everything after input i is a slice of this buffer, no copies needed
+    rest = memoryview(b''.join(empty_tx_ins) + suffix)
+    offsets = [0]
+    for empty_tx_in in empty_tx_ins:
+        offsets.append(offsets[-1] + len(empty_tx_in))
+
+    prefix = sha256(int_to_little_endian(tx.version, 4) + encode_varint(len(tx.tx_ins)))
+    sig_hashes = []
+    for index, signing_tx_in in enumerate(signing_tx_ins):
+        h = prefix.copy()
+        h.update(signing_tx_in)
+        h.update(rest[offsets[index + 1]:])
+        sig_hashes.append(int.from_bytes(sha256(h.digest()).digest(), 'big'))
+        prefix.update(empty_tx_ins[index])
+    return sig_hashes
+
+def outpoint_bytes(tx_in):
+    return tx_in.prev_tx[::-1] + int_to_little_endian(tx_in.prev_index, 4)
+
+def bip143_hashes(tx):
+    # hashPrevouts, hashSequence and hashOutputs are the same for every input
+    hash_prevouts = hash256(b''.join(outpoint_bytes(tx_in) for tx_in in tx.tx_ins))
+    hash_sequence = hash256(b''.join(int_to_little_endian(tx_in.sequence, 4) for tx_in in tx.tx_ins))
+    hash_outputs = hash256(b''.join(tx_out.serialize() for tx_out in tx.tx_outs))
+    return hash_prevouts, hash_sequence, hash_outputs
+
+def bip143_sig_hash(tx, input_index, script_code, amount, hashes=None):
+    # segwit v0 sighash. script_code for p2wpkh is the p2pkh script of the same
+    # hash160, amount is what the spent output holds
+    hash_prevouts, hash_sequence, hash_outputs = hashes or bip143_hashes(tx)
+    tx_in = tx.tx_ins[input_index]
+    s = int_to_little_endian(tx.version, 4)
+    s += hash_prevouts + hash_sequence
+    s += outpoint_bytes(tx_in)
+    s += script_code.serialize()
+    s += int_to_little_endian(amount, 8)
+    s += int_to_little_endian(tx_in.sequence, 4)
+    s += hash_outputs
+    s += int_to_little_endian(tx.locktime, 4)
+    s += int_to_little_endian(SIGHASH_ALL, 4)
+    return int.from_bytes(hash256(s), 'big')
+
+def bip143_sig_hashes(tx, script_codes, amounts):
+    # each preimage has a fixed size, so this is linear in the number of inputs
+    hashes = bip143_hashes(tx)
+    return [bip143_sig_hash(tx, index, script_code, amount, hashes)
+            for index, (script_code, amount) in enumerate(zip(script_codes, amounts))]
+
+def sign_digest(secret, z):
+    # runs in a worker process. signing only needs the secret, so skip
+    # PrivateKey's constructor and its point multiplication
+    key = PrivateKey.__new__(PrivateKey)
+    key.secret = secret
+    return key.sign(z).der()
+
+def sign_digests(secrets, sig_hashes, processes=None):
+    if processes == 1 or len(secrets) < PARALLEL_THRESHOLD:
+        return list(map(sign_digest, secrets, sig_hashes))
+    processes = processes or os.cpu_count()
+    chunksize = max(1, len(secrets) // (4 * processes))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        return list(executor.map(sign_digest, secrets, sig_hashes, chunksize=chunksize))
+
+def sign_transaction(tx, private_keys, processes=None):
+    # private_keys[i] signs tx.tx_ins[i], which must spend a p2pkh output
+    script_pubkeys = [p2pkh_script(private_key.point.hash160()) for private_key in private_keys]
+    sig_hashes = legacy_sig_hashes(tx, script_pubkeys)
+    secrets = [private_key.secret for private_key in private_keys]
+    ders = sign_digests(secrets, sig_hashes, processes)
+
+    # assemble the scriptSigs back into the transaction
+    for tx_in, der, private_key in zip(tx.tx_ins, ders, private_keys):
+        sig = der + SIGHASH_ALL.to_bytes(1, 'big')
+        sec = private_key.point.sec()
+        tx_in.script_sig = Script([sig, sec])
+    return tx
+
+def sign_segwit_transaction(tx, private_keys, amounts, processes=None):
+    # private_keys[i] signs tx.tx_ins[i], which must spend a p2wpkh output
+    # holding amounts[i] satoshis. serialize with serialize_witness()
+    script_codes = [p2pkh_script(private_key.point.hash160()) for private_key in private_keys]
+    sig_hashes = bip143_sig_hashes(tx, script_codes, amounts)
+    secrets = [private_key.secret for private_key in private_keys]
+    ders = sign_digests(secrets, sig_hashes, processes)
+
+    # signatures go in the witness, the scriptSig stays empty
+    for tx_in, der, private_key in zip(tx.tx_ins, ders, private_keys):
+        sig = der + SIGHASH_ALL.to_bytes(1, 'big')
+        tx_in.script_sig = Script()
+        tx_in.witness = [sig, private_key.point.sec()]
+    return tx
+
+def serialize_witness(tx):
+    # BIP144: marker & flag after the version, a witness per input before the locktime.
+    # tx.serialize() (and so tx.id()) leaves them out
+    if not any(getattr(tx_in, 'witness', None) for tx_in in tx.tx_ins):
+        return tx.serialize()
+    s = int_to_little_endian(tx.version, 4) + b'\x00\x01'
+    s += encode_varint(len(tx.tx_ins)) + b''.join(tx_in.serialize() for tx_in in tx.tx_ins)
+    s += encode_varint(len(tx.tx_outs)) + b''.join(tx_out.serialize() for tx_out in tx.tx_outs)
+    for tx_in in tx.tx_ins:
+        items = getattr(tx_in, 'witness', None) or []
+        s += encode_varint(len(items)) + b''.join(encode_varint(len(item)) + item for item in items)
+    s += int_to_little_endian(tx.locktime, 4)
+    return s
+
+def strip_witness(raw):
+    # raw transaction bytes in the legacy serialization Tx.parse understands
+    if raw[4:6] != b'\x00\x01':
+        return raw
+    stream = BytesIO(raw[6:])
+    num_inputs = read_varint(stream)
+    for _ in range(num_inputs):
+        stream.read(36)
+        stream.read(read_varint(stream) + 4)
+    num_outputs = read_varint(stream)
+    for _ in range(num_outputs):
+        stream.read(8)
+        stream.read(read_varint(stream))
+    end = 6 + stream.tell()
+    return raw[:4] + raw[6:end] + raw[-4:]
+
+def vsize(tx):
+    # witness bytes count a quarter
+    base = len(tx.serialize())
+    total = len(serialize_witness(tx))
+    return (3 * base + total + 3) // 4
+
+
+if __name__ == '__main__':
+    # 500-input consolidation spending outputs of 50 keys
+    num_inputs = 500
+    private_keys = [PrivateKey(randint(1, N - 1)) for _ in range(50)]
+    input_keys = [private_keys[index % len(private_keys)] for index in range(num_inputs)]
+    tx_ins = [TxIn(randint(0, 2**256 - 1).to_bytes(32, 'big'), 0) for _ in range(num_inputs)]
+    tx_outs = [TxOut(amount=num_inputs * 1000, script_pubkey=p2pkh_script(private_keys[0].point.hash160()))]
+
+    start = time.time()
+    tx = Tx(1, tx_ins, tx_outs, 0, True)
+    script_pubkeys = [p2pkh_script(key.point.hash160()) for key in input_keys]
+    expected = [legacy_sig_hash(tx, index, script_pubkey) for index, script_pubkey in enumerate(script_pubkeys)]
+    naive_time = time.time() - start
+    start = time.time()
+    assert legacy_sig_hashes(tx, script_pubkeys) == expected
+    print(f'sighashes: {naive_time:.2f}s reserializing, {time.time() - start:.2f}s with shared midstate')
+
+    start = time.time()
+    serial = sign_transaction(Tx(1, tx_ins, tx_outs, 0, True), input_keys, processes=1).serialize()
+    serial_time = time.time() - start
+    print(f'serial: {num_inputs} inputs in {serial_time:.2f}s')
+
+    start = time.time()
+    parallel = sign_transaction(Tx(1, tx_ins, tx_outs, 0, True), input_keys).serialize()
+    parallel_time = time.time() - start
+    print(f'parallel: {num_inputs} inputs in {parallel_time:.2f}s ({serial_time / parallel_time:.1f}x faster)')
+
+    # signatures are deterministic (RFC 6979), so both must agree
+    assert serial == parallel
+
+    # same spend from p2wpkh outputs
+    amounts = [1000] * num_inputs
+    start = time.time()
+    tx = Tx(1, tx_ins, tx_outs, 0, True)
+    script_codes = [p2pkh_script(key.point.hash160()) for key in input_keys]
+    expected = [bip143_sig_hash(tx, index, script_code, amount)
+                for index, (script_code, amount) in enumerate(zip(script_codes, amounts))]
+    naive_time = time.time() - start
+    start = time.time()
+    assert bip143_sig_hashes(tx, script_codes, amounts) == expected
+    print(f'bip143 sighashes: {naive_time:.2f}s rehashing, {time.time() - start:.2f}s with shared hashes')
+
+    start = time.time()
+    segwit = sign_segwit_transaction(Tx(1, tx_ins, tx_outs, 0, True), input_keys, amounts, processes=1)
+    segwit_time = time.time() - start
+    print(f'segwit serial: {num_inputs} inputs in {segwit_time:.2f}s (legacy {serial_time:.2f}s)')
+    legacy_vsize = len(serial)
+    segwit_vsize = vsize(segwit)
+    print(f'vsize: legacy {legacy_vsize} vB, segwit {segwit_vsize} vB ({1 - segwit_vsize / legacy_vsize:.0%} smaller)')
+    assert Tx.parse(BytesIO(strip_witness(serialize_witness(segwit)))).id() == segwit.id()
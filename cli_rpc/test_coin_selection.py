@@ -0,0 +1,44 @@
+import pytest
+
+from coin_selection import branch_and_bound, first_fit, knapsack, largest_first, select_coins, total
+
+
+def utxos(*amounts):
+    return [{'txid': f'{index:064x}', 'vout': 0, 'amount': amount} for index, amount in enumerate(amounts)]
+
+
+def test_branch_and_bound_exact_match():
+    coins = utxos(1000, 2000, 5000, 3000, 7000)
+    selected = branch_and_bound(coins, 6000, cost_of_change=0)
+    assert total(selected) == 6000
+
+def test_branch_and_bound_allows_up_to_cost_of_change_extra():
+    coins = utxos(4000, 6100, 9000)
+    assert [utxo['amount'] for utxo in branch_and_bound(coins, 6000, cost_of_change=200)] == [6100]
+
+def test_branch_and_bound_no_changeless_solution():
+    assert branch_and_bound(utxos(10_000, 20_000), 5000, cost_of_change=100) is None
+
+def test_bnb_falls_back_to_knapsack():
+    selected = select_coins(utxos(10_000, 20_000), 5000, 'bnb', cost_of_change=100, seed=0)
+    assert total(selected) >= 5000
+
+@pytest.mark.parametrize('strategy', ['bnb', 'knapsack', 'largest-first', 'first-fit'])
+def test_insufficient_funds(strategy):
+    assert select_coins(utxos(1000, 2000), 5000, strategy) is None
+
+def test_largest_first():
+    assert [utxo['amount'] for utxo in largest_first(utxos(1000, 5000, 3000), 6000)] == [5000, 3000]
+
+def test_first_fit():
+    assert [utxo['amount'] for utxo in first_fit(utxos(1000, 5000, 3000), 6000)] == [1000, 5000]
+
+def test_knapsack():
+    coins = utxos(*range(1000, 21_000, 1000))
+    assert total(knapsack(coins, 34_500, seed=1)) >= 34_500
+    # an exact match wins outright
+    assert [utxo['amount'] for utxo in knapsack(coins, 7000, seed=1)] == [7000]
+
+def test_knapsack_takes_smallest_larger_coin_when_smaller_ones_fall_short():
+    coins = utxos(1000, 2000, 50_000, 90_000)
+    assert [utxo['amount'] for utxo in knapsack(coins, 10_000, seed=1)] == [50_000]
@@ -0,0 +1,13 @@
+from descriptors import add_checksum
+
+
+def test_add_checksum():
+    # BIP380 test vector
+    assert add_checksum('raw(deadbeef)') == 'raw(deadbeef)#89f8spxm'
+
+def test_add_checksum_addr():
+    assert add_checksum('addr(mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j)') == 'addr(mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j)#02wpgw69'
+
+def test_checksum_changes_with_descriptor():
+    assert add_checksum('raw(deadbeef)') != add_checksum('raw(deadbeee)')
+    assert add_checksum('raw(deadbeef)') != add_checksum('raw(DEADBEEF)')
@@ -0,0 +1,47 @@
+from bedrock.script import p2pkh_script
+
+import fees
+from coin_selection import total
+from fees import (P2PKH_OUTPUT_SIZE, change_fee, estimate_size, fee_for, max_inputs, output_size,
+                  select_coins_by_fee_rate, wait_for_fee_rate)
+
+
+def utxos(*amounts):
+    return [{'txid': f'{index:064x}', 'vout': 0, 'amount': amount} for index, amount in enumerate(amounts)]
+
+
+def test_estimate_size():
+    # the classic 1-in 2-out p2pkh transaction
+    assert estimate_size(1, [34, 34]) == 226
+    assert output_size(p2pkh_script(bytes(20))) == P2PKH_OUTPUT_SIZE
+
+def test_fee_for_rounds_up():
+    assert fee_for(226, 1) == 226
+    assert fee_for(226, 1.5) == 339
+    assert fee_for(225, 0.01) == 3
+
+def test_change_fee():
+    assert change_fee(10) == 10 * P2PKH_OUTPUT_SIZE
+
+def test_select_coins_by_fee_rate():
+    script_pubkeys = [p2pkh_script(bytes(20))]
+    coins = utxos(*range(10_000, 110_000, 10_000))
+    selected, fee = select_coins_by_fee_rate(coins, 150_000, script_pubkeys, 10)
+    output_sizes = [output_size(script_pubkey) for script_pubkey in script_pubkeys]
+    assert fee == fee_for(estimate_size(len(selected), output_sizes), 10)
+    assert total(selected) >= 150_000 + fee
+
+def test_select_coins_by_fee_rate_insufficient():
+    assert select_coins_by_fee_rate(utxos(1000), 1000, [p2pkh_script(bytes(20))], 1) == (None, None)
+
+def test_max_inputs():
+    num_inputs = max_inputs(100_000, [P2PKH_OUTPUT_SIZE])
+    assert estimate_size(num_inputs, [P2PKH_OUTPUT_SIZE]) <= 100_000
+    assert estimate_size(num_inputs + 1, [P2PKH_OUTPUT_SIZE]) > 100_000
+
+def test_wait_for_fee_rate(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(fees.time, 'sleep', sleeps.append)
+    estimates = iter([None, 30, 12, 4])
+    assert wait_for_fee_rate(lambda: next(estimates), 5, poll_interval=60) == 4
+    assert sleeps == [60, 60, 60]
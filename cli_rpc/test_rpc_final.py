@@ -0,0 +1,126 @@
+import socket
+
+import pytest
+
+from bitcoinrpc.authproxy import JSONRPCException
+
+import rpc_final
+from rpc_final import WalletRPC, loaded_wallets, pool
+
+# the fake doesn't look inside descriptors, only at their checksums
+RECEIVING = 'pkh(tpubD6NzVbkrYhZ4XgiXtGrdW5XDAPFCL9h7we1vwNCpn8tGbBcgfVYjXyhWo4E1xkh56hjod1RhGjxbaTLV3X4FyWuejifB9jusQ46QzG87VKp/0/*)'
+CHANGE = 'pkh(tpubD6NzVbkrYhZ4XgiXtGrdW5XDAPFCL9h7we1vwNCpn8tGbBcgfVYjXyhWo4E1xkh56hjod1RhGjxbaTLV3X4FyWuejifB9jusQ46QzG87VKp/1/*)'
+
+
+def test_connections_are_reused(bitcoind):
+    pool.call('', 'getblockcount')
+    [proxy] = pool.idle['']
+    pool.call('', 'getblockcount')
+    assert pool.idle[''] == [proxy]
+    assert bitcoind.requests == 2
+
+def test_reconnects_when_bitcoind_closed_the_connection(bitcoind):
+    pool.call('', 'getblockcount')
+    [proxy] = pool.idle['']
+    # what bitcoind does to connections idle for -rpcservertimeout
+    proxy._AuthServiceProxy__conn.sock.shutdown(socket.SHUT_RDWR)
+    bitcoind.mine()
+    assert pool.call('', 'getblockcount') == 1
+    assert len(pool.idle['']) == 1 and pool.idle[''] != [proxy]
+
+def test_other_errors_are_not_retried(bitcoind):
+    pool.call('', 'getblockcount')
+    attempts = []
+    def request(proxy):
+        attempts.append(proxy)
+        raise socket.timeout('timed out')
+    with pytest.raises(socket.timeout):
+        pool.run('', request)
+    # bitcoind may still be working on it
+    assert len(attempts) == 1
+    # and the connection may be half way through a response
+    assert pool.idle[''] == []
+
+def test_rpc_errors_keep_the_connection(bitcoind):
+    with pytest.raises(JSONRPCException):
+        pool.call('', 'nosuchmethod')
+    assert len(pool.idle['']) == 1
+
+def test_batch_is_one_request(bitcoind):
+    bitcoind.mine(3)
+    with WalletRPC('').batch() as batch:
+        futures = [batch.getblockcount() for _ in range(5)]
+    assert [future.result() for future in futures] == [3] * 5
+    assert bitcoind.requests == 1
+
+def test_batch_error_fails_every_call(bitcoind):
+    with WalletRPC('').batch() as batch:
+        count = batch.getblockcount()
+        missing = batch.nosuchmethod()
+    for future in (count, missing):
+        with pytest.raises(JSONRPCException):
+            future.result()
+
+def test_wallets_load_on_first_use(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    WalletRPC('').create_watchonly_wallet('b')
+    # a node that was restarted before we ran
+    bitcoind.loaded.clear()
+    rpc_final.configure(bitcoind.url)
+    WalletRPC('a').get_balance()
+    assert bitcoind.loaded == {'a'}
+    WalletRPC('a').get_balance()
+    WalletRPC('b').get_balance()
+    assert bitcoind.loaded == {'a', 'b'}
+    assert bitcoind.calls.count('listwallets') == 1
+    assert bitcoind.calls.count('loadwallet') == 2
+
+def test_wallets_load_again_after_restart(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    WalletRPC('a').get_balance()
+    bitcoind.loaded.clear()
+    assert WalletRPC('a').get_balance() == (0, 0)
+    assert bitcoind.loaded == {'a'}
+
+def test_missing_wallet_is_an_error(bitcoind):
+    with pytest.raises(JSONRPCException) as e:
+        WalletRPC('nope').get_balance()
+    assert e.value.error['code'] == -18
+    assert 'nope' not in loaded_wallets.names
+
+def test_create_existing_wallet_loads_it(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    bitcoind.loaded.clear()
+    rpc_final.configure(bitcoind.url)
+    WalletRPC('').create_watchonly_wallet('a')
+    assert bitcoind.loaded == {'a'}
+
+def test_export_many_is_one_importmulti(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    WalletRPC('a').export_many([(RECEIVING, (0, 9), False, 'now'), (CHANGE, (0, 19), True, 0)])
+    assert bitcoind.calls.count('importmulti') == 1
+    imports = bitcoind.wallets['a'].imports
+    assert [(request['range'], request['internal'], request['timestamp']) for request in imports] == \
+        [([0, 9], False, 'now'), ([0, 19], True, 0)]
+    assert imports[0]['desc'].startswith(RECEIVING + '#')
+
+def test_export_many_raises_when_rejected(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    with pytest.raises(JSONRPCException) as e:
+        WalletRPC('a').export_many([(RECEIVING + '#qqqqqqqq', (0, 9), False, 'now')])
+    assert e.value.error['code'] == -5
+
+def test_list_since_block_reports_reorged_out_transactions(bitcoind):
+    WalletRPC('').create_watchonly_wallet('a')
+    bitcoind.mine(3)
+    txid = bitcoind.fund('a', 'mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j', 100_000)
+    bitcoind.mine(3)
+    rpc = WalletRPC('a')
+    lastblock = rpc.list_since_block(None, 3)['lastblock']
+    assert lastblock == bitcoind.blocks[4]
+    bitcoind.disconnect(3, drop=[txid])
+    bitcoind.mine(4)
+    since = rpc.list_since_block(lastblock, 3)
+    assert since['transactions'] == []
+    assert [entry['txid'] for entry in since['removed']] == [txid]
+    assert since['lastblock'] == bitcoind.blocks[5]
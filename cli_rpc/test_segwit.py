@@ -0,0 +1,71 @@
+import pytest
+
+from types import SimpleNamespace
+
+from fees import estimate_size
+from segwit import (decode_segwit_address, encode_segwit_address, is_segwit_address,
+                    p2wpkh_address, script_address, script_pubkey)
+
+# BIP173 valid addresses we support (witness v0) and their scriptPubKeys
+VALID = [
+    ('BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4', '0014751e76e8199196d454941c45d1b3a323f1433bd6'),
+    ('tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sl5k7',
+     '00201863143c14c5166804bd19203356da136c985678cd4d27a1b8c6329604903262'),
+    ('tb1qqqqqp399et2xygdj5xreqhjjvcmzhxw4aywxecjdzew6hylgvsesrxh6hy',
+     '0020000000c4a5cad46221b2a187905e5266362b99d5e91c6ce24d165dab93e86433'),
+]
+
+# BIP173 invalid addresses
+INVALID = [
+    # invalid human-readable part
+    'tc1qw508d6qejxtdg4y5r3zarvary0c5xw7kg3g4ty',
+    # invalid checksum
+    'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t5',
+    # invalid witness version
+    'BC13W508D6QEJXTDG4Y5R3ZARVARY0C5XW7KN40WF2',
+    # invalid program length
+    'bc1rw5uspcuh',
+    'bc10w508d6qejxtdg4y5r3zarvary0c5xw7kw508d6qejxtdg4y5r3zarvary0c5xw7kw5rljs90',
+    # invalid program length for witness version 0
+    'BC1QR508D6QEJXTDG4Y5R3ZARVARYV98GJ9P',
+    # mixed case
+    'tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3q0sL5k7',
+    # zero padding of more than 4 bits
+    'bc1zw508d6qejxtdg4y5r3zarvaryvqyzf3du',
+    # non-zero padding in 8-to-5 conversion
+    'tb1qrp33g0q5c5txsp9arysrx4k6zdkfs4nce4xj0gdcccefvpysxf3pjxtptv',
+    # empty data section
+    'bc1gmk9yu',
+]
+
+
+@pytest.mark.parametrize('address, script_hex', VALID)
+def test_valid_addresses(address, script_hex):
+    version, program = decode_segwit_address(address)
+    assert version == 0
+    assert program.hex() == script_hex[4:]
+    # Script.serialize() starts with the length
+    assert script_pubkey(address).serialize()[1:].hex() == script_hex
+    testnet = address.lower().startswith('tb')
+    assert script_address(script_pubkey(address), testnet) == address.lower()
+    assert encode_segwit_address(version, program, testnet) == address.lower()
+
+@pytest.mark.parametrize('address', INVALID)
+def test_invalid_addresses(address):
+    with pytest.raises(AssertionError):
+        decode_segwit_address(address)
+
+def test_p2wpkh_address():
+    # BIP173's example key, 0279be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+    point = SimpleNamespace(hash160=lambda: bytes.fromhex('751e76e8199196d454941c45d1b3a323f1433bd6'))
+    assert p2wpkh_address(point, testnet=False) == 'bc1qw508d6qejxtdg4y5r3zarvary0c5xw7kv8f3t4'
+    assert p2wpkh_address(point, testnet=True) == 'tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx'
+
+def test_is_segwit_address():
+    assert is_segwit_address('tb1qw508d6qejxtdg4y5r3zarvary0c5xw7kxpjzsx')
+    assert is_segwit_address('BC1QW508D6QEJXTDG4Y5R3ZARVARY0C5XW7KV8F3T4')
+    assert not is_segwit_address('mkmZxiEcEd8ZqjQWVZuC6so5dFMKEFpN2j')
+
+def test_p2wpkh_estimate_size():
+    # 1-in 1-out p2wpkh, 109.25 vB rounded up
+    assert estimate_size(1, [31], 'p2wpkh') == 110
@@ -0,0 +1,91 @@
+from io import BytesIO
+
+from bedrock.ecc import PrivateKey, S256Point, Signature
+from bedrock.script import Script, p2pkh_script
+from bedrock.tx import Tx
+
+from signing import (bip143_sig_hash, bip143_sig_hashes, legacy_sig_hash, legacy_sig_hashes,
+                     serialize_witness, sign_segwit_transaction, strip_witness, vsize)
+
+# BIP143 native P2WPKH example. input 0 spends a p2pk output, input 1 a p2wpkh one
+UNSIGNED = ('0100000002fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f0000000000eeffffff'
+            'ef51e1b804cc89d182d279655c3aa89e815b1b309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206'
+            '000000001976a9148280b37df378db99f66f85c95a783a76ac7a6d5988ac9093510d000000001976a9143bde42db'
+            'ee7e4dbe6a21b2d50ce2f0167faa815988ac11000000')
+# Script.parse() reads the length first
+INPUT_0_SCRIPT_SIG = ('494830450221008b9d1dc26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b'
+                      '194ba3f9281a99f2b1c0a19c0489bc22ede944ccf4ecbab4cc618ef3ed01')
+INPUT_1_SECRET = 0x619c335025c7f4012e556c2a58b2506e30b8511b53ade95ea316fd8c3286feb9
+INPUT_1_AMOUNT = 600000000
+SIG_HASH = 0xc37af31116d1b27caf68aae9e3ac82f1477929014d5b917657d0eb49478cb670
+WITNESS = [
+    '304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c4518331561406f90'
+    '300e8f3358f51928d43c212a8caed02de67eebee01',
+    '025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253f62fc70f07aeee6357',
+]
+SIGNED = ('01000000000102fff7f7881a8099afa6940d42d1e7f6362bec38171ea3edf433541db4e4ad969f00000000494830'
+          '450221008b9d1dc26ba6a9cb62127b02742fa9d754cd3bebf337f7a55d114c8e5cdd30be022040529b194ba3f9281a'
+          '99f2b1c0a19c0489bc22ede944ccf4ecbab4cc618ef3ed01eeffffffef51e1b804cc89d182d279655c3aa89e815b1b'
+          '309fe287d9b2b55d57b90ec68a0100000000ffffffff02202cb206000000001976a9148280b37df378db99f66f85c9'
+          '5a783a76ac7a6d5988ac9093510d000000001976a9143bde42dbee7e4dbe6a21b2d50ce2f0167faa815988ac000247'
+          '304402203609e17b84f6a7d30c80bfa610b5b4542f32a8a0d5447a12fb1366d7f01cc44a0220573a954c451833156140'
+          '6f90300e8f3358f51928d43c212a8caed02de67eebee0121025476c2e83188368da1ff3e292e7acafcdb3566bb0ad253'
+          'f62fc70f07aeee635711000000')
+
+# Programming Bitcoin's chapter 7 example, 452c629d67e41baec3ac6f04fe744b4b9617f8f859c63b3002f8684e7a4fee03.
+# its one input spends a p2pkh output of the key in its scriptSig
+LEGACY = ('0100000001813f79011acb80925dfe69b3def355fe914bd1d96a3f5f71bf8303c6a989c7d1000000006b48304502'
+          '2100ed81ff192e75a3fd2304004dcadb746fa5e24c5031ccfcf21320b0277457c98f02207a986d955c6e0cb35d446a'
+          '89d3f56100f4d7f67801c31967743a9c8e10615bed01210349fc4e631e3624a545de3f89f5d8684c7b8138bd94bdd5'
+          '31d2e213bf016b278afeffffff02a135ef01000000001976a914bc3b654dca7e56b04dca18f2566cdaf02e8d9ada88'
+          'ac99c39800000000001976a9141c4bc762dd5423e332166702cb75f40df79fea1288ac19430600')
+LEGACY_HASH160 = 'a802fc56c704ce87c42d7c92eb75e7896bdc41ae'
+LEGACY_SIG_HASH = 0x27e0c5994dec7824e56dec6b2fcb342eb7cdb0d0957c2fce9882f715e85d81a6
+
+
+def unsigned_tx():
+    return Tx.parse(BytesIO(bytes.fromhex(UNSIGNED)))
+
+def test_bip143_sig_hash():
+    tx = unsigned_tx()
+    key = PrivateKey(INPUT_1_SECRET)
+    script_code = p2pkh_script(bytes.fromhex('1d0f172a0ecb48aee1be1f2687d2963ae33f71a1'))
+    assert key.point.hash160().hex() == '1d0f172a0ecb48aee1be1f2687d2963ae33f71a1'
+    assert bip143_sig_hash(tx, 1, script_code, INPUT_1_AMOUNT) == SIG_HASH
+    assert bip143_sig_hashes(tx, [script_code, script_code], [625000000, INPUT_1_AMOUNT])[1] == SIG_HASH
+
+def test_sign_segwit_transaction():
+    tx = unsigned_tx()
+    key = PrivateKey(INPUT_1_SECRET)
+    sign_segwit_transaction(tx, [key, key], [625000000, INPUT_1_AMOUNT])
+    # signatures are deterministic (RFC 6979), so they match the vector exactly
+    assert [item.hex() for item in tx.tx_ins[1].witness] == WITNESS
+
+    # input 0 isn't ours, put the vector's p2pk scriptSig back
+    tx.tx_ins[0].script_sig = Script.parse(BytesIO(bytes.fromhex(INPUT_0_SCRIPT_SIG)))
+    tx.tx_ins[0].witness = []
+    signed = serialize_witness(tx)
+    assert signed.hex() == SIGNED
+    assert strip_witness(signed) == tx.serialize()
+    assert Tx.parse(BytesIO(strip_witness(signed))).id() == tx.id()
+    assert vsize(tx) < len(signed)
+
+def test_strip_witness_leaves_legacy_alone():
+    raw = bytes.fromhex(UNSIGNED)
+    assert strip_witness(raw) == raw
+
+def test_legacy_sig_hash():
+    tx = Tx.parse(BytesIO(bytes.fromhex(LEGACY)))
+    script_pubkey = p2pkh_script(bytes.fromhex(LEGACY_HASH160))
+    assert legacy_sig_hash(tx, 0, script_pubkey) == LEGACY_SIG_HASH
+    assert legacy_sig_hashes(tx, [script_pubkey]) == [LEGACY_SIG_HASH]
+    # the signature on chain is over that digest
+    der, sec = tx.tx_ins[0].script_sig.cmds
+    assert S256Point.parse(sec).verify(LEGACY_SIG_HASH, Signature.parse(der[:-1]))
+
+def test_legacy_sig_hashes_match_legacy_sig_hash():
+    # the shared midstate has to line up for every input, not just the first
+    tx = unsigned_tx()
+    script_pubkeys = [p2pkh_script(bytes([index]) * 20) for index in range(len(tx.tx_ins))]
+    expected = [legacy_sig_hash(tx, index, script_pubkey) for index, script_pubkey in enumerate(script_pubkeys)]
+    assert legacy_sig_hashes(tx, script_pubkeys) == expected
@@ -0,0 +1,110 @@
+import pytest
+
+from bedrock.ecc import PrivateKey
+
+from fees import P2PKH_OUTPUT_SIZE, estimate_size, fee_for
+from wallet_final import Wallet
+
+
+@pytest.fixture
+def wallet(bitcoind, tmp_path, monkeypatch):
+    # wallet.json, the seed cache and the history store all live in the cwd
+    monkeypatch.chdir(tmp_path)
+    _, wallet = Wallet.create('default')
+    yield wallet
+    wallet.wait_for_exports()
+
+def exported_ranges(bitcoind, change):
+    return [tuple(request['range']) for request in bitcoind.wallets['default'].imports
+            if request['internal'] == change]
+
+
+def test_create_exports_first_window(bitcoind, wallet):
+    assert bitcoind.calls.count('importmulti') == 1
+    assert exported_ranges(bitcoind, False) == [(0, 9)]
+    assert exported_ranges(bitcoind, True) == [(0, 9)]
+    # fresh keys, no rescan
+    assert {request['timestamp'] for request in bitcoind.wallets['default'].imports} == {'now'}
+    assert wallet.exported('default', False) == wallet.exported('default', True) == 10
+
+def test_half_used_window_is_topped_up_in_background(bitcoind, wallet):
+    for _ in range(4):
+        wallet.consume_address('default', False)
+    wallet.wait_for_exports()
+    assert bitcoind.calls.count('importmulti') == 1
+    wallet.consume_address('default', False)
+    wallet.wait_for_exports()
+    assert exported_ranges(bitcoind, False) == [(0, 9), (10, 14)]
+    # the change chain has its whole window left
+    assert exported_ranges(bitcoind, True) == [(0, 9)]
+    assert wallet.exported('default', False) == 15
+
+def test_used_up_window_is_exported_before_handing_out(bitcoind, wallet, monkeypatch):
+    # as if every background export had failed
+    monkeypatch.setattr(wallet, 'background_export', lambda account_name: None)
+    for _ in range(10):
+        wallet.consume_address('default', False)
+    assert bitcoind.calls.count('importmulti') == 1
+    address = wallet.consume_address('default', False)
+    assert bitcoind.calls.count('importmulti') == 2
+    assert wallet.exported('default', False) > 10
+    assert address == wallet.addresses('default')[10]
+
+def test_exported_ranges_leave_no_gaps(bitcoind, wallet):
+    for _ in range(60):
+        wallet.consume_address('default', False)
+    wallet.wait_for_exports()
+    exported = wallet.exported('default', False)
+    covered = set()
+    for start, end in exported_ranges(bitcoind, False):
+        covered.update(range(start, end + 1))
+    assert covered == set(range(exported))
+    # the window grew with the number of addresses handed out
+    assert exported - 60 > wallet.export_size // 2
+
+def test_history_syncs_incrementally(bitcoind, wallet):
+    address = wallet.consume_address('default', False)
+    txid = bitcoind.fund('default', address, 100_000)
+    [entry] = wallet.transactions('default')
+    assert (entry['txid'], entry['amount'], entry['confirmations']) == (txid, 100_000, 0)
+    bitcoind.mine(10)
+    [entry] = wallet.transactions('default')
+    assert entry['confirmations'] == 10
+    # the next sync starts history_depth blocks back
+    assert wallet.accounts['default']['lastblock'] == bitcoind.blocks[5]
+    assert wallet.sync_history('default') == []
+
+def test_reorged_out_transaction_leaves_history(bitcoind, wallet):
+    address = wallet.consume_address('default', False)
+    bitcoind.mine(3)
+    txid = bitcoind.fund('default', address, 100_000)
+    bitcoind.mine(7)
+    assert [entry['txid'] for entry in wallet.transactions('default')] == [txid]
+    # deeper than history_depth, so listsinceblock has to report it as removed
+    bitcoind.disconnect(7, drop=[txid])
+    bitcoind.mine(8)
+    assert wallet.transactions('default') == []
+    assert wallet.accounts['default']['lastblock'] == bitcoind.blocks[6]
+
+def test_reorged_transaction_stays_once_mined_again(bitcoind, wallet):
+    address = wallet.consume_address('default', False)
+    bitcoind.mine(3)
+    txid = bitcoind.fund('default', address, 100_000)
+    bitcoind.mine(7)
+    wallet.transactions('default')
+    bitcoind.disconnect(7)
+    bitcoind.mine(8)
+    [entry] = wallet.transactions('default')
+    assert (entry['txid'], entry['confirmations']) == (txid, 8)
+
+def test_send_many_pays_every_recipient(bitcoind, wallet):
+    bitcoind.fund('default', wallet.consume_address('default', False), 100_000)
+    bitcoind.mine()
+    payments = [(PrivateKey(secret).point.address(testnet=True), secret * 10_000) for secret in (1, 2)]
+    txid = wallet.send_many('default', payments, fee_rate=2)
+    [tx] = [tx for tx in bitcoind.mempool if tx.id() == txid]
+    assert [tx_out.amount for tx_out in tx.tx_outs[:2]] == [10_000, 20_000]
+    # one input, the two payments and our change
+    fee = 100_000 - sum(tx_out.amount for tx_out in tx.tx_outs)
+    assert fee == fee_for(estimate_size(1, [P2PKH_OUTPUT_SIZE] * 3), 2)
+    assert all(tx_in.script_sig.cmds for tx_in in tx.tx_ins)
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+
+from collections import OrderedDict
+from io import BytesIO
+
+from bedrock.tx import Tx
+
+from signing import strip_witness
+
+
+class TxCache:
+    # raw transactions by txid. a txid commits to the transaction's contents,
+    # so entries never go stale: raw bytes live in sqlite for good, recently
+    # parsed Tx objects in an LRU. callers must not modify the Tx they get
+
+    def __init__(self, filename='tx_cache.sqlite3', maxsize=1_000):
+        self.filename = filename
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.db = None
+        # shared by WalletRPC calls on worker threads
+        self.lock = threading.Lock()
+
+    def connect(self):
+        if self.db is None:
+            self.db = sqlite3.connect(self.filename, check_same_thread=False)
+            self.db.execute('CREATE TABLE IF NOT EXISTS txs (txid TEXT PRIMARY KEY, raw BLOB NOT NULL)')
+        return self.db
+
+    def remember(self, txid, tx):
+        self.entries[txid] = tx
+        # evict least recently used entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def get(self, txid):
+        with self.lock:
+            if txid in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(txid)
+                return self.entries[txid]
+            row = self.connect().execute('SELECT raw FROM txs WHERE txid = ?', (txid,)).fetchone()
+            if row is None:
+                return None
+            self.disk_hits += 1
+            tx = Tx.parse(BytesIO(row[0]), testnet=True)
+            self.remember(txid, tx)
+            return tx
+
+    def put(self, txid, raw):
+        # Tx.parse doesn't know witnesses, and they aren't part of the txid anyway
+        raw = strip_witness(raw)
+        tx = Tx.parse(BytesIO(raw), testnet=True)
+        assert tx.id() == txid, f'transaction doesn\'t hash to {txid}'
+        with self.lock:
+            db = self.connect()
+            with db:
+                db.execute('INSERT OR IGNORE INTO txs (txid, raw) VALUES (?, ?)', (txid, raw))
+            self.remember(txid, tx)
+        return tx
+
+    def fetch(self, txid, fetch_raw):
+        # fetch_raw(txid) returns the hex of a transaction we haven't seen
+        tx = self.get(txid)
+        if tx is None:
+            with self.lock:
+                self.misses += 1
+            tx = self.put(txid, bytes.fromhex(fetch_raw(txid)))
+        return tx
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.disk_hits = 0
+            self.misses = 0
+
+
+# shared by every WalletRPC in this process
+cache = TxCache()
+
+def cache_info():
+    return cache.info()
@@ -1,35 +1,121 @@
+import fcntl
 import json
+import asyncio
+import logging
+import threading
 
 from os.path import isfile
+from contextlib import contextmanager
+from decimal import Decimal
 from io import BytesIO
 from random import randint
+from concurrent.futures import ThreadPoolExecutor
 
 from bedrock.tx import Tx, TxIn, TxOut
 from bedrock.script import address_to_script_pubkey
 from bedrock.helper import sha256
 from bedrock.hd import HDPrivateKey
 
-from rpc_final import WalletRPC, sat_to_btc
+from rpc_final import DEFAULT_CONCURRENCY, AsyncWalletRPC, WalletRPC, btc_to_sat, sat_to_btc
+from address_cache import address, addresses
+from seed_cache import SeedCache
+from history import HistoryStore
+from segwit import script_pubkey
+from signing import serialize_witness, sign_segwit_transaction, sign_transaction
+from coin_selection import DUST
+from fees import MAX_STANDARD_SIZE, INPUT_SIZES, OUTPUT_SIZES, estimate_size, fee_for, max_inputs, output_size
+
+logger = logging.getLogger(__name__)
+
+# BIP44 legacy accounts, BIP84 native segwit ones
+PURPOSES = {'p2pkh': 44, 'p2wpkh': 84}
+DESCRIPTOR_FUNCTIONS = {'p2pkh': 'pkh', 'p2wpkh': 'wpkh'}
 
 class Wallet:
 
     filename = "wallet.json"
+    # the exported window grows with the number of addresses handed out, up to this
+    max_export_size = 1000
+    # keep re-reading this many blocks of history, so new confirmations and
+    # shallow reorgs make it into the history store
+    history_depth = 6
+    # limits on chaining sends onto our own unconfirmed change, matching
+    # bitcoind's default -limitancestorcount and -limitancestorsize
+    max_ancestors = 25
+    max_ancestor_size = 101_000
 
     def __init__(self, master_key, accounts, export_size):
         self.master_key = master_key
         self.accounts = accounts
         self.export_size = export_size
+        # background top-ups of the exported window, one at a time
+        self.lock = threading.RLock()
+        self.exporter = None
+        self.exporting = set()
 
     @classmethod
-    def create(cls, account_name, export_size=10):  # artificially low for testing
+    def create(cls, account_name, export_size=10, address_type='p2pkh'):  # artificially low for testing
         if isfile(cls.filename):
             raise OSError("wallet file already exists")
-        mnemonic, master_key = HDPrivateKey.generate(testnet=True)
+        mnemonic, master_key = SeedCache().generate(testnet=True)
         accounts = {}
         wallet = cls(master_key, accounts, export_size)
-        wallet.register_account(account_name)
+        wallet.register_account(account_name, address_type)
         return mnemonic, wallet
 
+    @classmethod
+    def restore(cls, mnemonic, account_names, gap_limit=20, export_size=10, address_type='p2pkh'):
+        if isfile(cls.filename):
+            raise OSError("wallet file already exists")
+        master_key = SeedCache().from_mnemonic(mnemonic, testnet=True)
+        accounts = {}
+        wallet = cls(master_key, accounts, export_size)
+        # nothing gets saved until the scan succeeds, so a failed restore can
+        # be retried. the scan exports its own windows, with a rescan
+        for account_name in account_names:
+            wallet.add_account(account_name, address_type)
+        # accounts are separate bitcoind wallets, so their rescans can run side by side
+        with ThreadPoolExecutor(max_workers=len(account_names)) as executor:
+            results = executor.map(lambda account_name: wallet.scan(account_name, gap_limit), account_names)
+            for account_name, (indices, exported) in zip(account_names, results):
+                account = wallet.accounts[account_name]
+                account['receiving_index'], account['change_index'] = indices[False], indices[True]
+                account['receiving_exported'], account['change_exported'] = exported[False], exported[True]
+        for account_name in account_names:
+            wallet.bitcoind_export(account_name)
+        wallet.save()
+        return wallet
+
+    def scan(self, account_name, gap_limit):
+        # each importmulti with a timestamp of 0 rescans from genesis, since
+        # we don't know when the wallet was first used. so import a window
+        # most wallets never get past on both chains in one go, and only
+        # import more for chains used to within gap_limit of its end.
+        # returns ({change: next index}, {change: exported})
+        rpc = WalletRPC(account_name)
+        address_type = self.address_type(account_name)
+        window_size = max(gap_limit, self.max_export_size)
+        next_index = {False: 0, True: 0}
+        exported = {False: 0, True: 0}
+        while True:
+            windows = {}
+            for change in (False, True):
+                if next_index[change] + gap_limit > exported[change]:
+                    windows[change] = range(exported[change], next_index[change] + window_size)
+            if not windows:
+                return next_index, exported
+            rpc.export_many([(self.descriptor(account_name, change), (window.start, window.stop - 1), change, 0)
+                             for change, window in windows.items()])
+            for change, window in windows.items():
+                chain_key = self.chain_key(account_name, change)
+                keys = [chain_key.traverse(f'm/{address_index}'.encode()) for address_index in window]
+                window_addresses = addresses([key.pub.point for key in keys], address_type=address_type)
+                used = rpc.get_used_addresses(window_addresses)
+                for address_index, window_address in zip(window, window_addresses):
+                    if window_address in used:
+                        next_index[change] = address_index + 1
+                exported[change] = window.stop
+
     def serialize(self):
         dict = {
             'master_key': self.master_key.serialize().hex(),
@@ -39,7 +125,7 @@ class Wallet:
         return json.dumps(dict, indent=4)
 
     def save(self):
-        with open(self.filename, 'w') as f:
+        with self.lock, open(self.filename, 'w') as f:
             data = self.serialize()
             f.write(data)
 
@@ -54,86 +140,179 @@ class Wallet:
     def open(cls):
         with open(cls.filename, 'r') as f:
             raw_json = f.read()
+            # Bitcoin Core watch-only wallets get loaded when first used
             wallet = cls.deserialize(raw_json)
-            # load associated Bitcoin Core watch-only wallets
-            for account_name in wallet.accounts.keys():
-                WalletRPC('').load_wallet(account_name)
             return wallet
 
-    def register_account(self, account_name):
+    @classmethod
+    @contextmanager
+    def locked(cls):
+        # open the wallet and keep other processes from saving it until we're
+        # done. whoever saves last wins, so a process saving a copy it opened
+        # earlier would undo keys handed out and spends marked in between
+        with open(cls.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            wallet = cls.open()
+            try:
+                yield wallet
+            finally:
+                # background exports save the wallet too
+                wallet.wait_for_exports()
+
+    def add_account(self, account_name, address_type='p2pkh'):
         assert account_name not in self.accounts, 'account already registered'
+        assert address_type in PURPOSES, f'unknown address type {address_type}'
         account_number = len(self.accounts)
         account = {
             'account_number': account_number,
             'receiving_index': 0,
             'change_index': 0,
+            'address_type': address_type,
         }
         self.accounts[account_name] = account
-        # create watch-only Bitcoin Core wallet
+        # create watch-only Bitcoin Core wallet, or reuse the one a previous
+        # install of this wallet left behind
         WalletRPC('').create_watchonly_wallet(account_name)
+
+    def register_account(self, account_name, address_type='p2pkh'):
+        self.add_account(account_name, address_type)
         # export first chunk of receiving & change addresses
-        self.bitcoind_export(account_name, True)
-        self.bitcoind_export(account_name, False)
+        self.bitcoind_export(account_name)
         self.save()
 
+    def address_type(self, account_name):
+        # accounts registered before segwit support are p2pkh
+        return self.accounts[account_name].get('address_type', 'p2pkh')
+
     def descriptor(self, account_name, change):
         account_number = self.accounts[account_name]['account_number']
-        account_path = f"m/44'/1'/{account_number}'".encode()
+        address_type = self.address_type(account_name)
+        account_path = f"m/{PURPOSES[address_type]}'/1'/{account_number}'".encode()
         account_xpub = self.master_key.traverse(account_path).xpub()
         change = int(change)
-        descriptor = f"pkh({account_xpub}/{change}/*)"
+        descriptor = f"{DESCRIPTOR_FUNCTIONS[address_type]}({account_xpub}/{change}/*)"
         return descriptor
 
-    def bitcoind_export(self, account_name, change):
+    def export_window(self, account_name, change):
+        # how far ahead of the cursor to export: the more addresses a chain
+        # has used, the more it's likely to need
         account = self.accounts[account_name]
-        descriptor = self.descriptor(account_name, change)
         address_index = account['change_index'] if change else account['receiving_index']
-        export_range = (address_index, address_index + self.export_size)
-        WalletRPC(account_name).export(descriptor, export_range, change)
+        return min(max(self.export_size, address_index), self.max_export_size)
 
-    def derive_key(self, account_name, change, address_index):
+    def exported(self, account_name, change):
+        # end (exclusive) of the range bitcoind is watching
+        account = self.accounts[account_name]
+        if change:
+            return account.get('change_exported', account['change_index'])
+        return account.get('receiving_exported', account['receiving_index'])
+
+    def export_due(self, account_name):
+        # chains with half their window or less left
         account = self.accounts[account_name]
-        account_number = account['account_number']
+        due = []
+        with self.lock:
+            for change in (False, True):
+                address_index = account['change_index'] if change else account['receiving_index']
+                if self.exported(account_name, change) - address_index <= self.export_window(account_name, change) // 2:
+                    due.append(change)
+        return due
+
+    def bitcoind_export(self, account_name):
+        # top up every chain that's due. both go in one importmulti
+        account = self.accounts[account_name]
+        exports = []
+        with self.lock:
+            for change in self.export_due(account_name):
+                address_index = account['change_index'] if change else account['receiving_index']
+                start = self.exported(account_name, change)
+                stop = address_index + self.export_window(account_name, change)
+                # never handed out, so there's nothing on chain to rescan for
+                exports.append((self.descriptor(account_name, change), (start, stop - 1), change, 'now'))
+        if not exports:
+            return
+        WalletRPC(account_name).export_many(exports)
+        # only move the mark once bitcoind is actually watching
+        with self.lock:
+            for _, (_, end), change, _ in exports:
+                key = 'change_exported' if change else 'receiving_exported'
+                account[key] = max(self.exported(account_name, change), end + 1)
+            self.save()
+
+    def background_export(self, account_name):
+        with self.lock:
+            if account_name in self.exporting:
+                return
+            self.exporting.add(account_name)
+            if self.exporter is None:
+                self.exporter = ThreadPoolExecutor(max_workers=1)
+        self.exporter.submit(self.run_export, account_name)
+
+    def run_export(self, account_name):
+        try:
+            self.bitcoind_export(account_name)
+        except Exception:
+            # next consume_address will try again
+            logger.exception(f'background export for "{account_name}" failed')
+        finally:
+            with self.lock:
+                self.exporting.discard(account_name)
+
+    def wait_for_exports(self):
+        # let background exports finish before the process exits
+        if self.exporter is not None:
+            self.exporter.shutdown(wait=True)
+            self.exporter = None
+
+    def chain_key(self, account_name, change):
+        account_number = self.accounts[account_name]['account_number']
+        purpose = PURPOSES[self.address_type(account_name)]
         change_number = int(change)
-        path_bytes = f"m/44'/1'/{account_number}'/{change_number}/{address_index}".encode()
+        path_bytes = f"m/{purpose}'/1'/{account_number}'/{change_number}".encode()
         return self.master_key.traverse(path_bytes)
 
+    def derive_key(self, account_name, change, address_index):
+        return self.chain_key(account_name, change).traverse(f'm/{address_index}'.encode())
+
     def keys(self, account_name):
         keys = []
         account = self.accounts[account_name]
-        # receiving addresses
-        for address_index in range(account['receiving_index']):
-            key = self.derive_key(account_name, False, address_index)
-            keys.append(key)
-        # change addresses
-        for address_index in range(account['change_index']):
-            key = self.derive_key(account_name, True, address_index)
-            keys.append(key)
+        # derive down to each chain once, then one step per address
+        for change, stop in ((False, account['receiving_index']), (True, account['change_index'])):
+            chain_key = self.chain_key(account_name, change)
+            for address_index in range(stop):
+                keys.append(chain_key.traverse(f'm/{address_index}'.encode()))
         return keys
 
-    def lookup_key(self, account_name, address):
-        for key in self.keys(account_name):
-            if key.pub.point.address(testnet=True) == address:
-                return key
+    def keys_by_address(self, account_name):
+        # build once per transaction, not once per input
+        keys = self.keys(account_name)
+        return dict(zip(addresses([key.pub.point for key in keys], address_type=self.address_type(account_name)), keys))
+
+    def lookup_key(self, account_name, output_address):
+        return self.keys_by_address(account_name).get(output_address)
 
     def addresses(self, account_name):
-        return [key.pub.point.address(testnet=True) for key in self.keys(account_name)]
+        return addresses([key.pub.point for key in self.keys(account_name)], address_type=self.address_type(account_name))
 
     def consume_address(self, account_name, change):
         account = self.accounts[account_name]
-        if change:
-            address_index = account['change_index']
-            if account['change_index'] % self.export_size == 0:
-                self.bitcoind_export(account_name, change)
-            account['change_index'] += 1
-        else:
-            address_index = account['receiving_index']
-            if account['receiving_index'] % self.export_size == 0:
-                self.bitcoind_export(account_name, change)
-            account['receiving_index'] += 1
+        # only wait on bitcoind if every exported address is used up
+        if account['change_index' if change else 'receiving_index'] >= self.exported(account_name, change):
+            self.bitcoind_export(account_name)
+        with self.lock:
+            if change:
+                address_index = account['change_index']
+                account['change_index'] += 1
+            else:
+                address_index = account['receiving_index']
+                account['receiving_index'] += 1
+            self.save()
+        # otherwise top up the window behind the caller's back
+        if self.export_due(account_name):
+            self.background_export(account_name)
         key = self.derive_key(account_name, change, address_index)
-        self.save()
-        return key.pub.point.address(testnet=True)
+        return address(key.pub.point, address_type=self.address_type(account_name))
 
     def balance(self, account_name):
         return WalletRPC(account_name).get_balance()
@@ -141,30 +320,191 @@ class Wallet:
     def unspent(self, account_name):
         return WalletRPC(account_name).get_unspent()
 
+    def sync_history(self, account_name):
+        # fetch what changed since the last sync, returns the new entries
+        account = self.accounts[account_name]
+        since = WalletRPC(account_name).list_since_block(account.get('lastblock'), self.history_depth)
+        # amounts and fees in satoshis so they survive json
+        def sats(entry):
+            return {key: btc_to_sat(value) if isinstance(value, Decimal) else value for key, value in entry.items()}
+        history = HistoryStore()
+        added = history.update(account_name,
+                               [sats(entry) for entry in since['transactions']],
+                               [sats(entry) for entry in since.get('removed', [])])
+        history.save()
+        # if the block got reorged out, bitcoind starts from the fork next time
+        with self.lock:
+            account['lastblock'] = since['lastblock']
+            self.save()
+        return added
+
     def transactions(self, account_name):
-        return WalletRPC(account_name).get_transactions()
+        self.sync_history(account_name)
+        return HistoryStore().transactions(account_name)
+
+    async def for_each_account(self, request, concurrency=DEFAULT_CONCURRENCY):
+        # await request(rpc) for every account at once, at most "concurrency"
+        # of them talking to bitcoind at a time. returns {account_name: result}
+        semaphore = asyncio.Semaphore(concurrency)
+        account_names = list(self.accounts)
+        results = await asyncio.gather(*[
+            request(AsyncWalletRPC(account_name, semaphore)) for account_name in account_names
+        ])
+        return dict(zip(account_names, results))
 
-    def send(self, account_name, address, amount, fee):
+    async def balances(self, concurrency=DEFAULT_CONCURRENCY):
+        return await self.for_each_account(lambda rpc: rpc.get_balance(), concurrency)
+
+    async def all_unspent(self, concurrency=DEFAULT_CONCURRENCY):
+        return await self.for_each_account(lambda rpc: rpc.get_unspent(), concurrency)
+
+    async def all_transactions(self, concurrency=DEFAULT_CONCURRENCY):
+        return await self.for_each_account(lambda rpc: rpc.get_transactions(), concurrency)
+
+    def transaction_fee(self, account_name, txid):
+        # inputs minus outputs, previous outputs come out of the tx cache
         rpc = WalletRPC(account_name)
+        tx = rpc.get_transaction(txid)
+        input_amount = sum(rpc.get_prevout(tx_in.prev_tx.hex(), tx_in.prev_index).amount for tx_in in tx.tx_ins)
+        output_amount = sum(tx_out.amount for tx_out in tx.tx_outs)
+        return input_amount - output_amount
+
+    def unconfirmed_change(self, account_name, unspent):
+        # our own unconfirmed change that can take one more transaction in
+        # the mempool. bitcoind only trusts unconfirmed outputs it could
+        # sign for, so fundrawtransaction never picks these from a
+        # watch-only wallet by itself
+        account = self.accounts[account_name]
+        change_keys = [self.derive_key(account_name, True, address_index) for address_index in range(account['change_index'])]
+        change_addresses = set(addresses([key.pub.point for key in change_keys], address_type=self.address_type(account_name)))
+        return [utxo for utxo in unspent
+                if utxo['confirmations'] == 0 and utxo['address'] in change_addresses
+                and utxo.get('ancestorcount', 1) < self.max_ancestors
+                and utxo.get('ancestorsize', 0) < self.max_ancestor_size]
+
+    def ancestors(self, utxos, size=0):
+        # (count, vsize) of the unconfirmed transactions a transaction of "size"
+        # vbytes spending utxos depends on, including itself. listunspent
+        # reports each unconfirmed output's, shared ancestors get counted
+        # twice, which errs on the safe side
+        parents = {utxo['txid']: utxo for utxo in utxos if utxo['confirmations'] == 0}.values()
+        return (1 + sum(parent.get('ancestorcount', 1) for parent in parents),
+                size + sum(parent.get('ancestorsize', 0) for parent in parents))
+
+    def within_ancestor_limits(self, utxos, size):
+        ancestors, ancestor_size = self.ancestors(utxos, size)
+        return ancestors <= self.max_ancestors and ancestor_size <= self.max_ancestor_size
 
-        # create unfunded transaction
+    def send(self, account_name, address, amount, fee_rate=None, spend_unconfirmed=False):
+        return self.send_many(account_name, [(address, amount)], fee_rate, spend_unconfirmed)
+
+    def send_many(self, account_name, payments, fee_rate=None, spend_unconfirmed=False):
+        # fundrawtransaction only takes a fee rate. without one bitcoind estimates it
+        rpc = WalletRPC(account_name)
+        address_type = self.address_type(account_name)
+        # also tells us the address and amount of every input bitcoind picks
+        unspent = rpc.get_unspent(0)
+        output_sizes = [output_size(script_pubkey(address)) for address, _ in payments] + [OUTPUT_SIZES[address_type]]
+
+        # create transaction paying every recipient. with spend_unconfirmed
+        # it starts out with as much of our unconfirmed change as it takes,
+        # as long as the mempool's ancestor limits allow
         tx_ins = []
-        tx_outs = [
-            {address: sat_to_btc(amount)},
-        ]
+        if spend_unconfirmed:
+            target = sum(amount for _, amount in payments)
+            selected = []
+            value = 0
+            for utxo in sorted(self.unconfirmed_change(account_name, unspent), key=lambda utxo: utxo['amount'], reverse=True):
+                if value >= target:
+                    break
+                if self.within_ancestor_limits(selected + [utxo], estimate_size(len(selected) + 1, output_sizes, address_type)):
+                    selected.append(utxo)
+                    value += btc_to_sat(utxo['amount'])
+            tx_ins = [{'txid': utxo['txid'], 'vout': utxo['vout']} for utxo in selected]
+        tx_outs = [{address: sat_to_btc(amount)} for address, amount in payments]
         rawtx = rpc.create_raw_transaction(tx_ins, tx_outs)
         
-        # fund it
+        # fund it, bitcoind adds confirmed coins if ours weren't enough
         change_address = self.consume_address(account_name, True)
-        fundedtx = rpc.fund_raw_transaction(rawtx, change_address)
+        fundedtx = rpc.fund_raw_transaction(rawtx, change_address, fee_rate)
 
         # sign
         tx = Tx.parse(BytesIO(bytes.fromhex(fundedtx)), testnet=True)
-        for index, tx_in in enumerate(tx.tx_ins):
-            output_address = rpc.get_address_for_outpoint(tx_in.prev_tx.hex(), tx_in.prev_index)
-            hd_private_key = self.lookup_key(account_name, output_address)
-            assert tx.sign_input(index, hd_private_key.private_key)
+        inputs = {(utxo['txid'], utxo['vout']): utxo for utxo in unspent}
+        spent = [inputs[(tx_in.prev_tx.hex(), tx_in.prev_index)] for tx_in in tx.tx_ins
+                 if (tx_in.prev_tx.hex(), tx_in.prev_index) in inputs]
+        assert self.within_ancestor_limits(spent, estimate_size(len(tx.tx_ins), output_sizes, address_type)), \
+            'too many unconfirmed ancestors'
+        private_keys = []
+        amounts = []
+        keys = self.keys_by_address(account_name)
+        for tx_in in tx.tx_ins:
+            outpoint = (tx_in.prev_tx.hex(), tx_in.prev_index)
+            if outpoint in inputs:
+                output_address = inputs[outpoint]['address']
+                amounts.append(btc_to_sat(inputs[outpoint]['amount']))
+            else:
+                output_address = rpc.get_address_for_outpoint(*outpoint)
+                amounts.append(rpc.get_prevout(*outpoint).amount)
+            private_keys.append(keys[output_address].private_key)
+        rawtx = self.sign(account_name, tx, private_keys, amounts)
         
         # broadcast
-        rawtx = tx.serialize().hex()
         return rpc.broadcast(rawtx)
+
+    def sign(self, account_name, tx, private_keys, amounts):
+        # returns the signed transaction's hex, with witnesses for segwit accounts
+        if self.address_type(account_name) == 'p2wpkh':
+            sign_segwit_transaction(tx, private_keys, amounts)
+        else:
+            sign_transaction(tx, private_keys)
+        return serialize_witness(tx).hex()
+
+    def consolidate(self, account_name, fee_rate, max_size=MAX_STANDARD_SIZE, count=None, spend_unconfirmed=False):
+        rpc = WalletRPC(account_name)
+
+        # smallest coins first, skipping any that cost more to spend than they're worth
+        address_type = self.address_type(account_name)
+        input_fee = fee_for(INPUT_SIZES[address_type], fee_rate)
+        if spend_unconfirmed:
+            unspent = rpc.get_unspent(0)
+            unspent = [utxo for utxo in unspent if utxo['confirmations'] > 0] + self.unconfirmed_change(account_name, unspent)
+        else:
+            unspent = rpc.get_unspent()
+        unspent = sorted(unspent, key=lambda utxo: utxo['amount'])
+        unspent = [utxo for utxo in unspent if btc_to_sat(utxo['amount']) > input_fee]
+        if count is not None:
+            unspent = unspent[:count]
+
+        # sweep each chunk that fits in max_size into one of our change addresses
+        output_sizes = [OUTPUT_SIZES[address_type]]
+        chunk_size = max_inputs(max_size, output_sizes, address_type)
+        assert chunk_size >= 2, 'max_size too small to consolidate anything'
+        keys = self.keys_by_address(account_name)
+        txids = []
+        for start in range(0, len(unspent), chunk_size):
+            chunk = unspent[start:start + chunk_size]
+            # nothing to gain from "consolidating" a single coin
+            # drop unconfirmed coins until the chunk as a whole fits the ancestor limits
+            while not self.within_ancestor_limits(chunk, estimate_size(len(chunk), output_sizes, address_type)):
+                chunk.remove(max(chunk, key=lambda utxo: utxo.get('ancestorsize', 0)))
+            if len(chunk) < 2:
+                break
+            fee = fee_for(estimate_size(len(chunk), output_sizes, address_type), fee_rate)
+            amount = sum(btc_to_sat(utxo['amount']) for utxo in chunk) - fee
+            if amount <= DUST:
+                break
+
+            # we pick the inputs, so no need for fundrawtransaction
+            tx_ins = [{'txid': utxo['txid'], 'vout': utxo['vout']} for utxo in chunk]
+            tx_outs = [{self.consume_address(account_name, True): sat_to_btc(amount)}]
+            rawtx = rpc.create_raw_transaction(tx_ins, tx_outs)
+
+            # sign, listunspent already told us which address each input belongs to
+            tx = Tx.parse(BytesIO(bytes.fromhex(rawtx)), testnet=True)
+            private_keys = [keys[utxo['address']].private_key for utxo in chunk]
+            rawtx = self.sign(account_name, tx, private_keys, [btc_to_sat(utxo['amount']) for utxo in chunk])
+
+            # broadcast
+            txids.append(rpc.broadcast(rawtx))
+        return txids
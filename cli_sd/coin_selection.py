@@ -0,0 +1,130 @@
+import time
+
+from random import Random
+
+# smallest change output worth creating, anything less goes to the miners
+DUST = 546
+
+
+def total(utxos):
+    return sum(utxo['amount'] for utxo in utxos)
+
+def first_fit(utxos, target, **kwargs):
+    # spend in the order the explorer returned them
+    selected = []
+    value = 0
+    for utxo in utxos:
+        selected.append(utxo)
+        value += utxo['amount']
+        if value >= target:
+            return selected
+    return None
+
+def largest_first(utxos, target, **kwargs):
+    return first_fit(sorted(utxos, key=lambda utxo: utxo['amount'], reverse=True), target)
+
+def branch_and_bound(utxos, target, cost_of_change=DUST, time_budget=0.5, max_tries=100_000, **kwargs):
+    # depth-first search for a changeless selection: inputs summing to
+    # between target and target + cost_of_change, wasting as little as possible
+    utxos = sorted(utxos, key=lambda utxo: utxo['amount'], reverse=True)
+    amounts = [utxo['amount'] for utxo in utxos]
+    # remaining[i] is what utxos[i:] could add at most
+    remaining = [0] * (len(amounts) + 1)
+    for i in reversed(range(len(amounts))):
+        remaining[i] = remaining[i + 1] + amounts[i]
+    if remaining[0] < target:
+        return None
+
+    deadline = time.monotonic() + time_budget
+    best = None
+    best_excess = cost_of_change + 1
+    # stack of (depth, selected indices, selected sum)
+    stack = [(0, (), 0)]
+    tries = 0
+    while stack and tries < max_tries:
+        tries += 1
+        if tries % 1000 == 0 and time.monotonic() > deadline:
+            break
+        depth, included, value = stack.pop()
+        # too much, or not enough left to get there
+        if value > target + cost_of_change or value + remaining[depth] < target:
+            continue
+        if value >= target:
+            if value - target < best_excess:
+                best = included
+                best_excess = value - target
+                if best_excess == 0:
+                    break
+            continue
+        if depth == len(amounts):
+            continue
+        # skip identical amounts we already decided to exclude
+        if depth == 0 or (included and included[-1] == depth - 1) or amounts[depth] != amounts[depth - 1]:
+            stack.append((depth + 1, included, value))
+            stack.append((depth + 1, included + (depth,), value + amounts[depth]))
+        else:
+            stack.append((depth + 1, included, value))
+    if best is None:
+        return None
+    return [utxos[i] for i in best]
+
+def knapsack(utxos, target, cost_of_change=DUST, iterations=1000, time_budget=0.5, seed=None, **kwargs):
+    # Bitcoin Core's pre-BnB stochastic approximation
+    rng = Random(seed)
+    exact = [utxo for utxo in utxos if utxo['amount'] == target]
+    if exact:
+        return exact[:1]
+    smaller = [utxo for utxo in utxos if utxo['amount'] < target + cost_of_change]
+    larger = [utxo for utxo in utxos if utxo['amount'] >= target + cost_of_change]
+    lowest_larger = min(larger, key=lambda utxo: utxo['amount']) if larger else None
+    smaller_total = total(smaller)
+    if smaller_total == target:
+        return smaller
+    if smaller_total < target:
+        return [lowest_larger] if lowest_larger else None
+
+    smaller.sort(key=lambda utxo: utxo['amount'], reverse=True)
+    amounts = [utxo['amount'] for utxo in smaller]
+    deadline = time.monotonic() + time_budget
+    best = [True] * len(amounts)
+    best_value = smaller_total
+    for _ in range(iterations):
+        if best_value == target or time.monotonic() > deadline:
+            break
+        included = [False] * len(amounts)
+        value = 0
+        reached_target = False
+        # first pass picks randomly, second pass fills in what the first skipped
+        for npass in range(2):
+            if reached_target:
+                break
+            for i, amount in enumerate(amounts):
+                include = rng.random() < 0.5 if npass == 0 else not included[i]
+                if include:
+                    value += amount
+                    included[i] = True
+                    if value >= target:
+                        reached_target = True
+                        if value < best_value:
+                            best_value = value
+                            best = included[:]
+                        value -= amount
+                        included[i] = False
+    selected = [utxo for utxo, include in zip(smaller, best) if include]
+    if lowest_larger and lowest_larger['amount'] <= best_value:
+        return [lowest_larger]
+    return selected
+
+def bnb(utxos, target, **kwargs):
+    # look for a changeless solution, fall back to knapsack if there isn't one
+    return branch_and_bound(utxos, target, **kwargs) or knapsack(utxos, target, **kwargs)
+
+STRATEGIES = {
+    'bnb': bnb,
+    'knapsack': knapsack,
+    'largest-first': largest_first,
+    'first-fit': first_fit,
+}
+
+def select_coins(utxos, target, strategy='bnb', **kwargs):
+    return STRATEGIES[strategy](utxos, target, **kwargs)
@@ -0,0 +1,124 @@
+import os
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from hashlib import sha256
+from random import randint
+
+from bedrock.ecc import N, PrivateKey
+from bedrock.helper import SIGHASH_ALL, encode_varint, hash256, int_to_little_endian
+from bedrock.script import Script, p2pkh_script
+from bedrock.tx import Tx, TxIn, TxOut
+
+# below this many inputs, starting worker processes costs more than it saves
+PARALLEL_THRESHOLD = 16
+
+
+def legacy_sig_hash(tx, input_index, script_pubkey):
+    # same as Tx.sig_hash, but we already know the script_pubkey being spent
+    # so there's no need to fetch the previous transaction
+    s = int_to_little_endian(tx.version, 4)
+    s += encode_varint(len(tx.tx_ins))
+    for index, tx_in in enumerate(tx.tx_ins):
+        script_sig = script_pubkey if index == input_index else Script()
+        s += TxIn(
+            prev_tx=tx_in.prev_tx,
+            prev_index=tx_in.prev_index,
+            script_sig=script_sig,
+            sequence=tx_in.sequence,
+        ).serialize()
+    s += encode_varint(len(tx.tx_outs))
+    for tx_out in tx.tx_outs:
+        s += tx_out.serialize()
+    s += int_to_little_endian(tx.locktime, 4)
+    s += int_to_little_endian(SIGHASH_ALL, 4)
+    return int.from_bytes(hash256(s), 'big')
+
+def legacy_sig_hashes(tx, script_pubkeys):
+    # legacy_sig_hash for every input at once. each preimage differs from the
+    # others only in which input carries its script_pubkey, so serialize every
+    # piece once and share one sha256 state for the prefix before that input
+    empty_tx_ins = []
+    signing_tx_ins = []
+    for tx_in, script_pubkey in zip(tx.tx_ins, script_pubkeys):
+        empty_tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, Script(), tx_in.sequence).serialize())
+        signing_tx_ins.append(TxIn(tx_in.prev_tx, tx_in.prev_index, script_pubkey, tx_in.sequence).serialize())
+    suffix = encode_varint(len(tx.tx_outs))
+    suffix += b''.join(tx_out.serialize() for tx_out in tx.tx_outs)
+    suffix += int_to_little_endian(tx.locktime, 4)
+    suffix += int_to_little_endian(SIGHASH_ALL, 4)
+
+    # everything after input i is a slice of this buffer, no copies needed
+    rest = memoryview(b''.join(empty_tx_ins) + suffix)
+    offsets = [0]
+    for empty_tx_in in empty_tx_ins:
+        offsets.append(offsets[-1] + len(empty_tx_in))
+
+    prefix = sha256(int_to_little_endian(tx.version, 4) + encode_varint(len(tx.tx_ins)))
+    sig_hashes = []
+    for index, signing_tx_in in enumerate(signing_tx_ins):
+        h = prefix.copy()
+        h.update(signing_tx_in)
+        h.update(rest[offsets[index + 1]:])
+        sig_hashes.append(int.from_bytes(sha256(h.digest()).digest(), 'big'))
+        prefix.update(empty_tx_ins[index])
+    return sig_hashes
+
+def sign_digest(secret, z):
+    # runs in a worker process. signing only needs the secret, so skip
+    # PrivateKey's constructor and its point multiplication
+    key = PrivateKey.__new__(PrivateKey)
+    key.secret = secret
+    return key.sign(z).der()
+
+def sign_transaction(tx, private_keys, processes=None):
+    # private_keys[i] signs tx.tx_ins[i], which must spend a p2pkh output
+    script_pubkeys = [p2pkh_script(private_key.point.hash160()) for private_key in private_keys]
+    sig_hashes = legacy_sig_hashes(tx, script_pubkeys)
+    secrets = [private_key.secret for private_key in private_keys]
+
+    if processes == 1 or len(private_keys) < PARALLEL_THRESHOLD:
+        ders = list(map(sign_digest, secrets, sig_hashes))
+    else:
+        processes = processes or os.cpu_count()
+        chunksize = max(1, len(secrets) // (4 * processes))
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            ders = list(executor.map(sign_digest, secrets, sig_hashes, chunksize=chunksize))
+
+    # assemble the scriptSigs back into the transaction
+    for tx_in, der, private_key in zip(tx.tx_ins, ders, private_keys):
+        sig = der + SIGHASH_ALL.to_bytes(1, 'big')
+        sec = private_key.point.sec()
+        tx_in.script_sig = Script([sig, sec])
+    return tx
+
+
+if __name__ == '__main__':
+    # 500-input consolidation spending outputs of 50 keys
+    num_inputs = 500
+    private_keys = [PrivateKey(randint(1, N - 1)) for _ in range(50)]
+    input_keys = [private_keys[index % len(private_keys)] for index in range(num_inputs)]
+    tx_ins = [TxIn(randint(0, 2**256 - 1).to_bytes(32, 'big'), 0) for _ in range(num_inputs)]
+    tx_outs = [TxOut(amount=num_inputs * 1000, script_pubkey=p2pkh_script(private_keys[0].point.hash160()))]
+
+    start = time.time()
+    tx = Tx(1, tx_ins, tx_outs, 0, True)
+    script_pubkeys = [p2pkh_script(key.point.hash160()) for key in input_keys]
+    expected = [legacy_sig_hash(tx, index, script_pubkey) for index, script_pubkey in enumerate(script_pubkeys)]
+    naive_time = time.time() - start
+    start = time.time()
+    assert legacy_sig_hashes(tx, script_pubkeys) == expected
+    print(f'sighashes: {naive_time:.2f}s reserializing, {time.time() - start:.2f}s with shared midstate')
+
+    start = time.time()
+    serial = sign_transaction(Tx(1, tx_ins, tx_outs, 0, True), input_keys, processes=1).serialize()
+    serial_time = time.time() - start
+    print(f'serial: {num_inputs} inputs in {serial_time:.2f}s')
+
+    start = time.time()
+    parallel = sign_transaction(Tx(1, tx_ins, tx_outs, 0, True), input_keys).serialize()
+    parallel_time = time.time() - start
+    print(f'parallel: {num_inputs} inputs in {parallel_time:.2f}s ({serial_time / parallel_time:.1f}x faster)')
+
+    # signatures are deterministic (RFC 6979), so both must agree
+    assert serial == parallel
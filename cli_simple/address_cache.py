@@ -0,0 +1,79 @@
+import json
+
+from collections import OrderedDict
+from os.path import isfile
+
+
+class AddressCache:
+
+    def __init__(self, maxsize=10_000, filename=None):
+        self.maxsize = maxsize
+        self.filename = filename
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        if filename and isfile(filename):
+            self.load()
+
+    def address(self, point, testnet=True):
+        # SEC serialization is cheap, hash160 + base58check are what we're avoiding
+        key = (point.sec().hex(), testnet)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+        self.misses += 1
+        address = point.address(testnet=testnet)
+        self.entries[key] = address
+        # evict least recently used entry
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+        return address
+
+    def addresses(self, points, testnet=True):
+        return [self.address(point, testnet) for point in points]
+
+    def info(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.entries),
+            'maxsize': self.maxsize,
+        }
+
+    def clear(self):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        with open(self.filename, 'r') as f:
+            data = json.load(f)
+        for sec, testnet, address in data[-self.maxsize:]:
+            self.entries[(sec, testnet)] = address
+
+    def save(self):
+        if not self.filename:
+            return
+        data = [[sec, testnet, address] for (sec, testnet), address in self.entries.items()]
+        with open(self.filename, 'w') as f:
+            json.dump(data, f)
+
+
+# shared by every wallet in this process
+cache = AddressCache()
+
+def address(point, testnet=True):
+    return cache.address(point, testnet)
+
+def addresses(points, testnet=True):
+    return cache.addresses(points, testnet)
+
+def cache_info():
+    return cache.info()
+
+def persist(filename):
+    # reuse addresses encoded by previous processes
+    cache.filename = filename
+    if isfile(filename):
+        cache.load()
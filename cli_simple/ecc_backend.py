@@ -0,0 +1,192 @@
+import json
+import logging
+import time
+
+from hashlib import sha256
+from os.path import dirname, isfile, join
+from random import randint
+
+from bedrock.ecc import N, PrivateKey, S256Point
+
+# secp256k1 field prime and generator point
+P = 2**256 - 2**32 - 977
+GX = 0x79be667ef9dcbbac55a06295ce870b07029bfcdb2dce28d959f2815b16f81798
+GY = 0x483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
+
+# G multiplication table: table[i][j] is j * 256**i * G
+WINDOW = 8
+WINDOWS = 256 // WINDOW
+TABLE_FILENAME = join(dirname(__file__), 'g_table.json')
+# sha256 of serialize_table(build_table())
+TABLE_SHA256 = '4fc5526f9a42497fef848d4dea6d2c16863f6f1ba21a618943090794139db456'
+
+logger = logging.getLogger(__name__)
+
+
+def jacobian_double(point):
+    x, y, z = point
+    if y == 0:
+        return (0, 0, 0)
+    ysq = y * y % P
+    s = 4 * x * ysq % P
+    m = 3 * x * x % P
+    nx = (m * m - 2 * s) % P
+    ny = (m * (s - nx) - 8 * ysq * ysq) % P
+    nz = 2 * y * z % P
+    return (nx, ny, nz)
+
+def jacobian_add_affine(point, affine):
+    # add an affine point (z=1) to a jacobian one, cheaper than a full addition
+    x1, y1, z1 = point
+    x2, y2 = affine
+    if z1 == 0:
+        return (x2, y2, 1)
+    z1z1 = z1 * z1 % P
+    u2 = x2 * z1z1 % P
+    s2 = y2 * z1 * z1z1 % P
+    if u2 == x1:
+        if s2 != y1:
+            return (0, 0, 0)
+        return jacobian_double(point)
+    h = (u2 - x1) % P
+    r = (s2 - y1) % P
+    hh = h * h % P
+    hhh = h * hh % P
+    v = x1 * hh % P
+    nx = (r * r - hhh - 2 * v) % P
+    ny = (r * (v - nx) - y1 * hhh) % P
+    nz = z1 * h % P
+    return (nx, ny, nz)
+
+def to_affine(point):
+    x, y, z = point
+    z_inv = pow(z, -1, P)
+    z_inv2 = z_inv * z_inv % P
+    return (x * z_inv2 % P, y * z_inv2 * z_inv % P)
+
+def build_table():
+    table = []
+    base = (GX, GY)
+    for _ in range(WINDOWS):
+        row = [None, base]
+        point = (base[0], base[1], 1)
+        for _ in range(2, 2**WINDOW):
+            point = jacobian_add_affine(point, base)
+            row.append(to_affine(point))
+        table.append(row)
+        # next window's base is 256 * base
+        point = (base[0], base[1], 1)
+        for _ in range(WINDOW):
+            point = jacobian_double(point)
+        base = to_affine(point)
+    return table
+
+def serialize_table(table):
+    data = {
+        'window': WINDOW,
+        'table': [[(f'{x:x}', f'{y:x}') for x, y in row[1:]] for row in table],
+    }
+    return json.dumps(data).encode()
+
+def load_table(filename=TABLE_FILENAME):
+    # the table only depends on the curve, so a file with any other digest
+    # is stale, edited or truncated. one sha256 instead of an addition per entry
+    if isfile(filename):
+        with open(filename, 'rb') as f:
+            raw = f.read()
+        if sha256(raw).hexdigest() == TABLE_SHA256:
+            data = json.loads(raw)
+            return [[None] + [(int(x, 16), int(y, 16)) for x, y in row] for row in data['table']]
+        logger.warning(f'{filename} is corrupt, rebuilding it')
+    table = build_table()
+    raw = serialize_table(table)
+    assert sha256(raw).hexdigest() == TABLE_SHA256, 'TABLE_SHA256 is out of date'
+    try:
+        with open(filename, 'wb') as f:
+            f.write(raw)
+    except OSError:
+        pass  # read-only checkout, we'll just rebuild next time
+    return table
+
+
+class PythonBackend:
+
+    name = 'python'
+
+    def __init__(self):
+        self.table = None
+
+    def multiply(self, secret):
+        # precompute lazily so importing this module stays cheap
+        if self.table is None:
+            self.table = load_table()
+        point = (0, 0, 0)
+        for row in self.table:
+            digit = secret & (2**WINDOW - 1)
+            if digit:
+                point = jacobian_add_affine(point, row[digit])
+            secret >>= WINDOW
+        return to_affine(point)
+
+
+class CoincurveBackend:
+
+    name = 'coincurve'
+
+    def __init__(self):
+        import coincurve
+        self.coincurve = coincurve
+
+    def multiply(self, secret):
+        public_key = self.coincurve.PublicKey.from_secret(secret.to_bytes(32, 'big'))
+        return public_key.point()
+
+
+def available_backends():
+    backends = {'python': PythonBackend}
+    try:
+        import coincurve
+        backends['coincurve'] = CoincurveBackend
+    except ImportError:
+        pass
+    return backends
+
+def set_backend(name):
+    global backend
+    backend = available_backends()[name]()
+    return backend
+
+def default_backend():
+    backends = available_backends()
+    if 'coincurve' in backends:
+        return backends['coincurve']()
+    return backends['python']()
+
+backend = default_backend()
+
+def private_key(secret):
+    # same PrivateKey that bedrock builds, minus its slow double-and-add
+    x, y = backend.multiply(secret)
+    key = PrivateKey.__new__(PrivateKey)
+    key.secret = secret
+    key.point = S256Point(x, y)
+    return key
+
+
+if __name__ == '__main__':
+    count = 200
+    secrets = [randint(1, N - 1) for _ in range(count)]
+
+    start = time.time()
+    expected = [PrivateKey(secret).point.sec() for secret in secrets]
+    bedrock_time = time.time() - start
+    print(f'bedrock: {count} keys in {bedrock_time:.3f}s')
+
+    for name, backend_class in available_backends().items():
+        backend = backend_class()
+        backend.multiply(1)  # exclude table loading from the measurement
+        start = time.time()
+        actual = [private_key(secret).point.sec() for secret in secrets]
+        elapsed = time.time() - start
+        assert actual == expected, f'{name} backend produced different keys'
+        print(f'{name}: {count} keys in {elapsed:.3f}s ({bedrock_time / elapsed:.1f}x faster)')
@@ -0,0 +1,207 @@
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+from concurrent.futures import Future
+from contextlib import contextmanager
+from os.path import isfile
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentScheduler:
+    # in-process intake: submit() returns a Future resolving to the txid of
+    # the batch the payment went out in
+
+    def __init__(self, send_many, window=60, max_outputs=100):
+        self.send_many = send_many
+        self.window = window
+        self.max_outputs = max_outputs
+        # (address, amount, future, enqueue time)
+        self.queue = []
+        self.condition = threading.Condition()
+        self.running = False
+        self.thread = None
+
+    def submit(self, address, amount):
+        future = Future()
+        with self.condition:
+            self.queue.append((address, amount, future, time.monotonic()))
+            self.condition.notify()
+        return future
+
+    def oldest(self):
+        # enqueue time of the longest waiting payment. leftovers of a batch
+        # cut short by max_outputs keep their place in the window
+        return self.queue[0][3]
+
+    def due(self):
+        if not self.queue:
+            return False
+        return len(self.queue) >= self.max_outputs or time.monotonic() - self.oldest() >= self.window
+
+    def take_batch(self):
+        batch = self.queue[:self.max_outputs]
+        self.queue = self.queue[self.max_outputs:]
+        return batch
+
+    def flush(self):
+        with self.condition:
+            batch = self.take_batch()
+        if not batch:
+            return None
+        payments = [(address, amount) for address, amount, _, _ in batch]
+        try:
+            txid = self.send_many(payments)
+        except Exception as e:
+            logger.exception(f'batch of {len(batch)} payments failed')
+            for _, _, future, _ in batch:
+                future.set_exception(e)
+            return None
+        logger.debug(f'sent batch of {len(batch)} payments: {txid}')
+        for _, _, future, _ in batch:
+            future.set_result(txid)
+        return txid
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.due():
+                    timeout = None
+                    if self.queue:
+                        timeout = max(0, self.oldest() + self.window - time.monotonic())
+                    self.condition.wait(timeout)
+                if not self.running:
+                    break
+            self.flush()
+        # don't leave anyone waiting on a payment that was never sent
+        while self.queue:
+            self.flush()
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+
+
+class PaymentQueue:
+    # file-backed intake, so separate CLI invocations can queue payments and
+    # a later "flush" (or the "schedule" daemon) sends them as one batch.
+    # every read-modify-write of the file holds an flock, so payments queued
+    # while a batch is being sent aren't lost. a payment goes
+    # queued -> sending -> sent (or failed), and "sending" is saved before
+    # anything is broadcast: a crash mid-send leaves the batch marked
+    # instead of paying it twice
+
+    filename = 'payments.json'
+
+    def __init__(self, filename=None):
+        self.filename = filename or self.filename
+        self.load()
+
+    @contextmanager
+    def locked(self):
+        # load, let the caller modify self.payments, save
+        with open(self.filename + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()
+            yield self.payments
+            self.save()
+
+    def load(self):
+        self.payments = []
+        if isfile(self.filename):
+            with open(self.filename, 'r') as f:
+                self.payments = json.load(f)
+
+    def save(self):
+        # write a new file and swap it in, so readers never see half of one
+        with open(self.filename + '.tmp', 'w') as f:
+            json.dump(self.payments, f, indent=4)
+        os.replace(self.filename + '.tmp', self.filename)
+
+    def add(self, address, amount):
+        receipt = uuid.uuid4().hex
+        with self.locked() as payments:
+            payments.append({
+                'receipt': receipt,
+                'address': address,
+                'amount': amount,
+                'queued_at': time.time(),
+                'status': 'queued',
+                'txid': None,
+            })
+        return receipt
+
+    def status(self, payment):
+        # files written before statuses only had the txid
+        return payment.get('status', 'sent' if payment['txid'] else 'queued')
+
+    def pending(self):
+        return [payment for payment in self.payments if self.status(payment) == 'queued']
+
+    def lookup(self, receipt):
+        for payment in self.payments:
+            if payment['receipt'] == receipt:
+                return payment
+
+    def due(self, window, max_outputs):
+        pending = self.pending()
+        if not pending:
+            return False
+        oldest = min(payment['queued_at'] for payment in pending)
+        return len(pending) >= max_outputs or time.time() - oldest >= window
+
+    def update(self, receipts, **fields):
+        with self.locked() as payments:
+            for payment in payments:
+                if payment['receipt'] in receipts:
+                    payment.update(fields)
+
+    def flush(self, send_many, max_outputs):
+        with self.locked():
+            batch = self.pending()[:max_outputs]
+            for payment in batch:
+                payment['status'] = 'sending'
+        if not batch:
+            return None
+        receipts = {payment['receipt'] for payment in batch}
+        try:
+            txid = send_many([(payment['address'], payment['amount']) for payment in batch])
+        except Exception as e:
+            # may or may not have reached the network, so don't retry on our own
+            self.update(receipts, status='failed', error=str(e))
+            raise
+        self.update(receipts, status='sent', txid=txid)
+        return txid
+
+    def retry(self):
+        # send failed payments again with the next batch. only for failures
+        # that are known not to have been broadcast
+        with self.locked() as payments:
+            for payment in payments:
+                if self.status(payment) == 'failed':
+                    payment['status'] = 'queued'
+                    payment.pop('error', None)
+
+    def schedule(self, send_many, window=60, max_outputs=100, poll_interval=1):
+        # daemon loop: pick up payments queued by other processes
+        while True:
+            self.load()
+            if self.due(window, max_outputs):
+                try:
+                    txid = self.flush(send_many, max_outputs)
+                    logger.debug(f'sent queued batch: {txid}')
+                except Exception:
+                    logger.exception('sending queued batch failed')
+            time.sleep(poll_interval)
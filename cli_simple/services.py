@@ -11,6 +11,7 @@ UNSPENT_URL = ADDRESS_URL + '/unspent'
 BITPAY = 'https://test-insight.bitpay.com/api'
 TRANSACTION_URL = BITPAY + '/addrs/{}/txs'
 BROADCAST_URL = BITPAY + '/tx/send'
+FEE_ESTIMATE_URL = BITPAY + '/utils/estimatefee?nbBlocks={}'
 
 def get(url):
     response = requests.get(url,)
@@ -39,6 +40,20 @@ def get_balance(addresses):
         confirmed += address['confirmed']['balance_int']
     return unconfirmed, confirmed
 
+def get_used_addresses(addresses):
+    # one request tells us which of a batch of addresses have ever been used
+    used = set()
+    addresses = ','.join(addresses)
+    data = get(BALANCE_URL.format(addresses))
+    if 'address' in data:
+        addresses = [data['address']]
+    else:
+        addresses = data['addresses']
+    for address in addresses:
+        if address['total']['transaction_count'] > 0:
+            used.add(address['address'])
+    return used
+
 def get_transactions(addresses):
     addresses = ','.join(addresses)
     return get(TRANSACTION_URL.format(addresses))['items']
@@ -57,9 +72,18 @@ def get_unspent(addresses):
             'prev_index': tx['n'],
             'amount': tx['value_int'],
             'address': tx['addresses'][0],
+            'confirmations': tx['confirmations'],
         })
     return unspent
 
+def get_fee_estimate(blocks=6):
+    # insight reports BTC per kilobyte, convert to satoshis per vbyte
+    data = get(FEE_ESTIMATE_URL.format(blocks))
+    # -1 means not enough data to estimate
+    if data[str(blocks)] < 0:
+        return None
+    return data[str(blocks)] * 100_000_000 / 1000
+
 def broadcast(rawtx):
     data = {'rawtx': rawtx}
     response = post(BROADCAST_URL, data)